@@ -23,6 +23,26 @@ function clearUserData() {
     localStorage.removeItem('p2p_chat_user');
 }
 
+// Usernames whose presence we follow, kept per browser
+function getContacts() {
+    try {
+        return JSON.parse(localStorage.getItem('p2p_chat_contacts')) || [];
+    } catch (error) {
+        console.error('Error parsing contacts:', error);
+        return [];
+    }
+}
+
+function addContact(username) {
+    const contacts = getContacts();
+    if (contacts.includes(username)) {
+        return false;
+    }
+    contacts.push(username);
+    localStorage.setItem('p2p_chat_contacts', JSON.stringify(contacts));
+    return true;
+}
+
 async function registerUser(username, email, password) {
     try {
         const response = await fetch('http://localhost:5000/api/register', {
@@ -118,24 +138,51 @@ async function logoutUser() {
     }
 }
 
-async function checkUsernameAvailability(username) {
+// In-flight availability checks by field, so a newer keystroke cancels the older request
+const availabilityRequests = {};
+
+function cancelAvailabilityCheck(field) {
+    if (availabilityRequests[field]) {
+        availabilityRequests[field].abort();
+        delete availabilityRequests[field];
+    }
+}
+
+async function fetchAvailability(field, url) {
+    cancelAvailabilityCheck(field);
+    
+    const controller = new AbortController();
+    availabilityRequests[field] = controller;
+    
     try {
-        const response = await fetch(`http://localhost:5000/api/check-username?username=${encodeURIComponent(username)}`);
+        const response = await fetch(url, { signal: controller.signal });
         const data = await response.json();
         return data.available;
+    } finally {
+        if (availabilityRequests[field] === controller) {
+            delete availabilityRequests[field];
+        }
+    }
+}
+
+async function checkUsernameAvailability(username) {
+    try {
+        return await fetchAvailability('username', `http://localhost:5000/api/check-username?username=${encodeURIComponent(username)}`);
     } catch (error) {
-        console.error('Error checking username:', error);
+        if (error.name !== 'AbortError') {
+            console.error('Error checking username:', error);
+        }
         throw error;
     }
 }
 
 async function checkEmailAvailability(email) {
     try {
-        const response = await fetch(`http://localhost:5000/api/check-email?email=${encodeURIComponent(email)}`);
-        const data = await response.json();
-        return data.available;
+        return await fetchAvailability('email', `http://localhost:5000/api/check-email?email=${encodeURIComponent(email)}`);
     } catch (error) {
-        console.error('Error checking email:', error);
+        if (error.name !== 'AbortError') {
+            console.error('Error checking email:', error);
+        }
         throw error;
     }
 }
@@ -164,7 +211,8 @@ async function updateUserProfile(userData) {
 
         const updatedUser = {
             ...currentUser,
-            ...userData
+            ...userData,
+            token: data.token || currentUser.token
         };
         storeUserData(updatedUser);
 
@@ -229,12 +229,14 @@ document.getElementById('user-search-input').addEventListener('input', function(
     });
 });
 
+function findUserItem(username) {
+    return document.querySelector(`#active-users-list .user-item[data-username="${CSS.escape(username)}"]`);
+}
+
 function addUserToList(username, isOnline = true) {
     const usersList = document.getElementById('active-users-list');
     
-    const existingUser = Array.from(usersList.querySelectorAll('.user-item')).find(
-        item => item.querySelector('.user-item-name').textContent === username
-    );
+    const existingUser = findUserItem(username);
     
     if (existingUser) {
         const statusElement = existingUser.querySelector('.user-item-status');
@@ -275,16 +277,6 @@ function addUserToList(username, isOnline = true) {
     usersList.appendChild(userItem);
 }
 
-function updateUsersList(users) {
-    const usersList = document.getElementById('active-users-list');
-    
-    usersList.innerHTML = '';
-    
-    users.forEach(username => {
-        addUserToList(username);
-    });
-}
-
 function initiateChat(username) {
     document.getElementById('contact-name').textContent = username;
     document.getElementById('connection-status').textContent = 'Connecting...';
@@ -303,12 +295,6 @@ function initiateChat(username) {
 document.addEventListener('DOMContentLoaded', function() {
     if (!checkAuth()) return;
     
-    fetch('/api/users')
-        .then(response => response.json())
-        .then(data => {
-            updateUsersList(data.active_users);
-        })
-        .catch(error => {
-            console.error('Error fetching users:', error);
-        });
+    // Contacts show as offline until the server reports their presence
+    getContacts().forEach(username => addUserToList(username, false));
 });
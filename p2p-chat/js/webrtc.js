@@ -11,21 +11,42 @@ let isInitiator = false;
 let iceCandidatesBuffer = [];
 let currentPeer = null;
 
+// Outgoing ICE candidates are gathered for a short window and sent as one 'signal_batch'
+const CANDIDATE_BATCH_WINDOW_MS = 50;
+let outgoingCandidates = [];
+let outgoingCandidatesTimer = null;
+
+// Presence version last applied for each watched username; older updates are ignored
+let presenceVersions = {};
+
+// Offers and answers are sent deflated when the server relays that and the peer can inflate it
+const SDP_ENCODING = 'deflate-raw';
+const canCompactSdp = supportsSdpEncoding(SDP_ENCODING);
+let serverSdpEncodings = [];
+let peerSdpEncodings = {};
+
 function connectSignaling() {
     socket = io('http://localhost:5000', {
+        // Straight to a websocket, without the long-polling handshake and upgrade
+        transports: ['websocket'],
         reconnectionAttempts: 5,
         reconnectionDelay: 1000
     });
 
+    socket.on('connect_error', () => {
+        // Websockets may be blocked on the way; retry with long-polling first
+        socket.io.opts.transports = ['polling', 'websocket'];
+    });
+
     socket.on('connect', () => {
         console.log('Connected to signaling server');
         updateStatus('Connected to signaling server');
         
         const user = getUserData();
-        if (user) {
+        if (user && user.token) {
             socket.emit('authenticate', {
-                user_id: user.id,
-                username: user.username
+                token: user.token,
+                contacts: getContacts()
             });
         } else {
             console.error('No user data available for authentication');
@@ -37,9 +58,13 @@ function connectSignaling() {
         console.log('Authenticated with server:', data);
         updateStatus('Ready to chat');
         
-        if (data.active_users) {
-            updateUsersList(data.active_users);
+        // The server hands out a fresh token when ours is getting old
+        if (data.token) {
+            storeUserData({ ...getUserData(), token: data.token });
         }
+        
+        serverSdpEncodings = data.sdp_encodings || [];
+        applyPresenceSnapshot(data.presence);
     });
 
     socket.on('auth_error', (data) => {
@@ -47,32 +72,30 @@ function connectSignaling() {
         updateStatus('Authentication error: ' + data.message);
     });
 
-    socket.on('user_joined', (data) => {
-        console.log('User joined:', data);
-        displaySystemMessage(`${data.username} has joined the chat`);
-        
-        if (data.active_users) {
-            updateUsersList(data.active_users);
-        }
-    });
-
-    socket.on('user_left', (data) => {
-        console.log('User left:', data);
-        displaySystemMessage(`${data.username} has left the chat`);
-        
-        if (data.active_users) {
-            updateUsersList(data.active_users);
-        }
-        
-        if (currentPeer === data.username) {
-            displaySystemMessage(`Your chat with ${data.username} has ended`);
-            cleanupPeerConnection();
-            currentPeer = null;
-        }
+    socket.on('presence_update', (data) => {
+        // Changes of the users we watch, merged by the server
+        data.changes.forEach(([version, op, username]) => {
+            if (!applyPresenceChange(version, username, op === 'add')) {
+                return;
+            }
+            if (op === 'add') {
+                displaySystemMessage(`${username} is online`);
+                return;
+            }
+            
+            displaySystemMessage(`${username} went offline`);
+            
+            if (currentPeer === username) {
+                displaySystemMessage(`Your chat with ${username} has ended`);
+                cleanupPeerConnection();
+                currentPeer = null;
+            }
+        });
     });
 
     socket.on('disconnect', () => {
         console.log('Disconnected from signaling server');
+        presenceVersions = {};
         updateStatus('Disconnected from signaling server');
         enableChat(false);
         cleanupPeerConnection();
@@ -83,7 +106,120 @@ function connectSignaling() {
         updateStatus(data.message);
     });
 
+    socket.on('presence_snapshot', applyPresenceSnapshot);
+
+    socket.on('signal_error', (data) => {
+        console.error('Signal error:', data.message);
+    });
+
+    socket.on('rate_limited', (data) => {
+        console.warn(`Rate limited on '${data.event}', retry in ${data.retry_after}s`);
+    });
+
     socket.on('signal', handleSignalingData);
+
+    socket.on('signal_batch', handleSignalBatch);
+}
+
+function applyPresenceSnapshot(snapshot) {
+    const online = new Set(snapshot.online);
+    snapshot.watching.forEach(username => {
+        applyPresenceChange(snapshot.version, username, online.has(username));
+    });
+}
+
+function applyPresenceChange(version, username, isOnline) {
+    // A snapshot at version V covers every change up to V
+    if (version < (presenceVersions[username] || 0)) {
+        return false;
+    }
+    presenceVersions[username] = version;
+    addUserToList(username, isOnline);
+    return true;
+}
+
+function watchContact(username) {
+    if (!addContact(username)) {
+        return;
+    }
+    addUserToList(username, false);
+    if (socket && socket.connected) {
+        socket.emit('watch', { usernames: [username] });
+    }
+}
+
+function queueOutgoingCandidate(candidate) {
+    outgoingCandidates.push(candidate);
+    
+    if (!outgoingCandidatesTimer) {
+        outgoingCandidatesTimer = setTimeout(flushOutgoingCandidates, CANDIDATE_BATCH_WINDOW_MS);
+    }
+}
+
+function flushOutgoingCandidates() {
+    if (outgoingCandidatesTimer) {
+        clearTimeout(outgoingCandidatesTimer);
+        outgoingCandidatesTimer = null;
+    }
+    
+    if (outgoingCandidates.length === 0 || !currentPeer) {
+        outgoingCandidates = [];
+        return;
+    }
+    
+    console.log(`Sending ${outgoingCandidates.length} ICE candidates`);
+    socket.emit('signal_batch', {
+        target: currentPeer,
+        signals: outgoingCandidates.map(candidate => ({
+            type: 'candidate',
+            candidate: candidate
+        }))
+    });
+    outgoingCandidates = [];
+}
+
+async function handleSignalBatch(data) {
+    // Apply in order so candidates are never handled ahead of each other
+    for (const signal of data.signals || []) {
+        signal.sender = data.sender;
+        await handleSignalingData(signal);
+    }
+}
+
+function supportsSdpEncoding(encoding) {
+    try {
+        new CompressionStream(encoding);
+        new DecompressionStream(encoding);
+        return true;
+    } catch (error) {
+        return false;
+    }
+}
+
+async function describeSdp(type, sdp) {
+    // Tell the peer which SDP encodings we read, and use one it reads when the server relays it
+    const signal = {
+        type: type,
+        target: currentPeer,
+        sdp_encodings: canCompactSdp ? [SDP_ENCODING] : []
+    };
+    if (canCompactSdp && serverSdpEncodings.includes(SDP_ENCODING) &&
+            (peerSdpEncodings[currentPeer] || []).includes(SDP_ENCODING)) {
+        const stream = new Blob([sdp]).stream().pipeThrough(new CompressionStream(SDP_ENCODING));
+        signal.sdp = new Uint8Array(await new Response(stream).arrayBuffer());
+        signal.sdp_encoding = SDP_ENCODING;
+    } else {
+        signal.sdp = sdp;
+    }
+    return signal;
+}
+
+async function readSdp(data) {
+    if (data.sdp_encoding !== SDP_ENCODING) {
+        return data.sdp;
+    }
+    const stream = new Blob([data.sdp]).stream().pipeThrough(new DecompressionStream(SDP_ENCODING));
+    return new Response(stream).text();
 }
 
 function cleanupPeerConnection() {
@@ -96,6 +232,11 @@ function cleanupPeerConnection() {
         peerConnection = null;
     }
     iceCandidatesBuffer = [];
+    outgoingCandidates = [];
+    if (outgoingCandidatesTimer) {
+        clearTimeout(outgoingCandidatesTimer);
+        outgoingCandidatesTimer = null;
+    }
     enableChat(false);
 }
 
@@ -119,12 +260,10 @@ function createPeerConnection() {
 
     peerConnection.onicecandidate = (event) => {
         if (event.candidate) {
-            console.log('Sending ICE candidate');
-            socket.emit('signal', {
-                type: 'candidate',
-                candidate: event.candidate,
-                target: currentPeer
-            });
+            queueOutgoingCandidate(event.candidate);
+        } else {
+            // Gathering finished, no point waiting out the window
+            flushOutgoingCandidates();
         }
     };
 
@@ -196,6 +335,7 @@ async function handleSignalingData(data) {
             if (!currentPeer || data.sender.username === currentPeer) {
                 if (!currentPeer && data.type === 'offer') {
                     currentPeer = data.sender.username;
+                    watchContact(currentPeer);
                     document.getElementById('contact-name').textContent = currentPeer;
                     displaySystemMessage(`Incoming chat request from ${currentPeer}`);
                 }
@@ -203,6 +343,10 @@ async function handleSignalingData(data) {
                 console.log(`Ignoring signal from ${data.sender.username}, already chatting with ${currentPeer}`);
                 return;
             }
+            
+            if (data.sdp_encodings) {
+                peerSdpEncodings[data.sender.username] = data.sdp_encodings;
+            }
         }
         
         if (!peerConnection) {
@@ -211,9 +355,10 @@ async function handleSignalingData(data) {
         }
 
         if (data.type === 'offer') {
-            console.log('Processing offer with SDP:', data.sdp ? data.sdp.substring(0, 50) + '...' : 'undefined');
+            const sdp = await readSdp(data);
+            console.log('Processing offer with SDP:', sdp ? sdp.substring(0, 50) + '...' : 'undefined');
             
-            if (!data.sdp) {
+            if (!sdp) {
                 console.error('Offer missing SDP data');
                 return;
             }
@@ -221,7 +366,7 @@ async function handleSignalingData(data) {
             try {
                 const offerDesc = new RTCSessionDescription({
                     type: 'offer',
-                    sdp: data.sdp
+                    sdp: sdp
                 });
                 
                 await peerConnection.setRemoteDescription(offerDesc);
@@ -230,11 +375,7 @@ async function handleSignalingData(data) {
                 
                 console.log('Sending answer with SDP:', answer.sdp ? answer.sdp.substring(0, 50) + '...' : 'undefined');
                 
-                socket.emit('signal', {
-                    type: 'answer',
-                    sdp: answer.sdp,
-                    target: currentPeer
-                });
+                socket.emit('signal', await describeSdp('answer', answer.sdp));
                 
                 await processBufferedCandidates();
             } catch (error) {
@@ -242,9 +383,10 @@ async function handleSignalingData(data) {
                 updateStatus('Error processing offer: ' + error.message);
             }
         } else if (data.type === 'answer') {
-            console.log('Processing answer with SDP:', data.sdp ? data.sdp.substring(0, 50) + '...' : 'undefined');
+            const sdp = await readSdp(data);
+            console.log('Processing answer with SDP:', sdp ? sdp.substring(0, 50) + '...' : 'undefined');
             
-            if (!data.sdp) {
+            if (!sdp) {
                 console.error('Answer missing SDP data');
                 return;
             }
@@ -252,7 +394,7 @@ async function handleSignalingData(data) {
             try {
                 const answerDesc = new RTCSessionDescription({
                     type: 'answer',
-                    sdp: data.sdp
+                    sdp: sdp
                 });
                 
                 await peerConnection.setRemoteDescription(answerDesc);
@@ -309,6 +451,7 @@ function connectToPeer(username) {
     cleanupPeerConnection();
     
     currentPeer = username;
+    watchContact(username);
     
     startChat();
 }
@@ -323,11 +466,7 @@ async function startChat() {
         await peerConnection.setLocalDescription(offer);
         console.log('Sending offer');
         
-        socket.emit('signal', {
-            type: 'offer',
-            sdp: offer.sdp,
-            target: currentPeer
-        });
+        socket.emit('signal', await describeSdp('offer', offer.sdp));
     } catch (error) {
         console.error('Error starting chat:', error);
         updateStatus('Error: ' + error.message);
@@ -0,0 +1,78 @@
+import hmac
+
+from flask import Blueprint, abort, current_app, jsonify, request
+
+from profiling import memory_tracer, profiler, slow_events, ProfilerBusy
+
+admin = Blueprint('admin', __name__)
+
+@admin.before_request
+def require_admin_token():
+    """Only answer requests carrying ADMIN_TOKEN in X-Admin-Token"""
+    expected = current_app.config.get('ADMIN_TOKEN')
+    if not expected:
+        # Disabled unless a token is configured
+        abort(404)
+    token = request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8')):
+        abort(403)
+
+@admin.route('/profile')
+def profile():
+    """Sample every thread's stack for a few seconds and return collapsed stacks"""
+    seconds = request.args.get('seconds', 5, type=float)
+    interval = request.args.get('interval', 0.005, type=float)
+    if not 0 < seconds or not 0.001 <= interval <= 1:
+        return jsonify({'success': False, 'message': 'Invalid seconds or interval'}), 400
+
+    # Sleep through the event loop so the server keeps handling the load being profiled
+    socketio = current_app.extensions['socketio']
+    try:
+        samples, stacks = profiler.profile(seconds, interval, wait=socketio.sleep)
+    except ProfilerBusy:
+        return jsonify({'success': False, 'message': 'A profile is already running'}), 409
+
+    if request.args.get('format') == 'json':
+        return jsonify({'success': True, 'samples': samples, 'interval': interval, 'stacks': stacks})
+
+    # flamegraph.pl / speedscope input: "root;...;leaf count" per line
+    body = ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+    return body, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+@admin.route('/slow-events')
+def get_slow_events():
+    """Socket events slower than SLOW_EVENT_THRESHOLD, split into Mongo, emit and other time"""
+    return jsonify({
+        'success': True,
+        'threshold_ms': slow_events.threshold * 1000,
+        'events': slow_events.recent(request.args.get('event'))
+    })
+
+@admin.route('/slow-events', methods=['DELETE'])
+def clear_slow_events():
+    slow_events.clear()
+    return jsonify({'success': True})
+
+@admin.route('/tracemalloc/start', methods=['POST'])
+def start_tracemalloc():
+    """Start tracing allocations and take the baseline snapshot"""
+    memory_tracer.start()
+    return jsonify({'success': True, 'frames': memory_tracer.frames})
+
+@admin.route('/tracemalloc/diff')
+def tracemalloc_diff():
+    """Largest allocation changes since the baseline; reset=1 makes this the new baseline"""
+    group_by = request.args.get('group_by', 'lineno')
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        return jsonify({'success': False, 'message': 'group_by must be lineno, filename or traceback'}), 400
+    diff = memory_tracer.diff(group_by=group_by,
+                              limit=request.args.get('limit', 25, type=int),
+                              reset=request.args.get('reset') == '1')
+    if diff is None:
+        return jsonify({'success': False, 'message': 'Tracing is not started'}), 409
+    return jsonify(dict(diff, success=True))
+
+@admin.route('/tracemalloc/stop', methods=['POST'])
+def stop_tracemalloc():
+    memory_tracer.stop()
+    return jsonify({'success': True})
@@ -1,9 +1,9 @@
 from flask import Blueprint, request, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.utils import secure_filename
-from models import User
+from models import User, user_cache
+from tokens import socket_tokens
+from avatars import avatar_store, AvatarError, AvatarTooLarge
 from datetime import datetime
-import os
 
 api = Blueprint('api', __name__)
 
@@ -17,16 +17,13 @@ def register():
         password = data.get('password')
         
         # Check if username or email already exists
-        existing_user_by_username = User.get_by_username(username)
-        existing_user_by_email = User.get_by_email(email)
-        
-        if existing_user_by_username:
+        if User.exists_by_username(username):
             return jsonify({
                 'success': False,
                 'message': 'Username already exists'
             }), 400
             
-        if existing_user_by_email:
+        if User.exists_by_email(email):
             return jsonify({
                 'success': False,
                 'message': 'Email already registered'
@@ -60,13 +57,16 @@ def login():
         password = data.get('password')
         remember = data.get('remember', False)
         
-        user = User.get_by_email(email)
+        # Only the id and hash are needed until the password checks out
+        auth_fields = User.get_auth_fields_by_email(email)
         
-        if user and user.check_password(password):
+        if auth_fields and User.verify_password(auth_fields['password_hash'], password):
+            user = User.get_by_id(auth_fields['_id'])
             login_user(user, remember=remember)
             
-            # Update last login time
+            # Update last login time, upgrading an outdated password hash on the way
             user.last_login = datetime.utcnow()
+            user.upgrade_password_hash(password, auth_fields['password_hash'])
             user.save()
             
             return jsonify({
@@ -79,7 +79,7 @@ def login():
                 'display_name': user.display_name,
                 'bio': user.bio,
                 'status': user.status,
-                'token': 'dummy-token'  # In a real app, generate a proper JWT token
+                'token': socket_tokens.issue(user._id, user.username)
             })
         
         return jsonify({
@@ -113,8 +113,7 @@ def check_username():
             'message': 'Username parameter is required'
         }), 400
     
-    user = User.get_by_username(username)
-    return jsonify({'available': user is None})
+    return jsonify({'available': User.is_username_available(username)})
 
 @api.route('/check-email', methods=['GET'])
 def check_email():
@@ -126,8 +125,12 @@ def check_email():
             'message': 'Email parameter is required'
         }), 400
     
-    user = User.get_by_email(email)
-    return jsonify({'available': user is None})
+    return jsonify({'available': User.is_email_available(email)})
+
+@api.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    """API endpoint exposing user cache hit/miss counters"""
+    return jsonify(user_cache.stats())
 
 @api.route('/profile', methods=['GET'])
 @login_required
@@ -153,8 +156,7 @@ def update_profile():
         # Update fields that are provided
         if 'username' in data and data['username'] != current_user.username:
             # Check if username is available
-            existing_user = User.get_by_username(data['username'])
-            if existing_user and str(existing_user._id) != str(current_user._id):
+            if User.exists_by_username(data['username']):
                 return jsonify({
                     'success': False,
                     'message': 'Username already exists'
@@ -164,8 +166,7 @@ def update_profile():
         
         if 'email' in data and data['email'] != current_user.email:
             # Check if email is available
-            existing_user = User.get_by_email(data['email'])
-            if existing_user and str(existing_user._id) != str(current_user._id):
+            if User.exists_by_email(data['email']):
                 return jsonify({
                     'success': False,
                     'message': 'Email already registered'
@@ -187,6 +188,8 @@ def update_profile():
         return jsonify({
             'success': True,
             'message': 'Profile updated successfully',
+            # Socket tokens carry the username, so a rename needs a new one
+            'token': socket_tokens.issue(current_user._id, current_user.username),
             'user': {
                 'id': str(current_user._id),
                 'username': current_user.username,
@@ -257,36 +260,42 @@ def upload_profile_picture():
             'message': 'No selected file'
         }), 400
         
-    if file and allowed_file(file.filename):
-        # Generate a secure filename
-        filename = secure_filename(file.filename)
-        # Add timestamp to make filename unique
-        filename = f"{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{filename}"
-        
-        # Create uploads directory if it doesn't exist
-        os.makedirs('static/uploads/profile_pictures', exist_ok=True)
-        
-        # Save the file
-        file_path = os.path.join('static/uploads/profile_pictures', filename)
-        file.save(file_path)
+    if file and avatar_store.allowed_file(file.filename):
+        # Stream to disk under the content hash and make the thumbnails
+        try:
+            content_hash = avatar_store.save(file.stream)
+        except AvatarTooLarge as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 413
+        except AvatarError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
         
-        # Update user profile picture URL
-        current_user.profile_picture = f"/static/uploads/profile_pictures/{filename}"
+        # Update user profile picture, pointing at the largest thumbnail
+        previous_hash = current_user.avatar
+        previous_url = current_user.profile_picture
+        current_user.avatar = content_hash
+        current_user.profile_picture = avatar_store.url(content_hash, avatar_store.sizes[-1])
         current_user.save()
         
+        # Clean up the picture this one replaces, unless another user has it too
+        if previous_hash and previous_hash != content_hash and not User.avatar_in_use(previous_hash):
+            avatar_store.remove(previous_hash)
+        elif not previous_hash:
+            avatar_store.remove_legacy(previous_url)
+        
         return jsonify({
             'success': True,
             'message': 'Profile picture uploaded successfully',
-            'profile_picture_url': current_user.profile_picture
+            'profile_picture_url': current_user.profile_picture,
+            'thumbnails': avatar_store.thumbnail_urls(content_hash)
         })
     
     return jsonify({
         'success': False,
         'message': 'File type not allowed'
     }), 400
-
-# Helper function to check if file extension is allowed
-def allowed_file(filename):
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -1,180 +1,209 @@
-from flask import Flask, request, render_template_string, render_template, redirect, url_for, jsonify
-from flask_socketio import SocketIO, emit, send, join_room, leave_room
+import threading
+import time
+
+import click
+from flask import Flask, current_app, request, render_template, redirect, url_for, jsonify
+from flask.cli import with_appcontext
+from flask_socketio import SocketIO, emit, send, join_room, leave_room, rooms
 from flask_cors import CORS
 from flask_login import LoginManager, current_user, login_required
-import time
-import threading
-import queue
-import os
-from datetime import datetime
 from bson.objectid import ObjectId
+from pymongo.errors import PyMongoError
 
 from config import Config
-from models import mongo, User, ChatSession, create_indexes
+from models import (mongo, user_cache, availability, password_hasher, User, create_indexes,
+                    warm_availability_filter)
+from hashing import HashingBusy
+from journal import SessionJournal
+from negotiation import NegotiationTracker
+from metrics import metrics
+from profiling import profiler, slow_events, memory_tracer
+from ratelimit import RateLimiter
+from serializer import packet_serializers
+from presence import create_presence_registry, presence_room, chat_room, PresenceBroadcaster
+from server_log import ServerLog, DASHBOARD_ROOM
+from tokens import socket_tokens
+from transports import transport_policy
+from avatars import avatar_store, avatars
 from auth import auth
 from api import api
+from admin import admin
 
-# Create uploads directory if it doesn't exist
-os.makedirs('static/uploads/profile_pictures', exist_ok=True)
+socketio = SocketIO()
 
-app = Flask(__name__, static_folder='static', static_url_path='/static')
-app.config.from_object(Config)
-CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Dashboard log, pushed to the dashboard room in batches
+server_log = ServerLog()
 
-# Initialize MongoDB
-mongo.init_app(app)
+# Chat session records are written behind, in batches
+session_journal = SessionJournal()
 
-# Initialize login manager
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
 
+# Authenticated sids, indexed by sid, user_id and username (shared between workers in
+# multi-node mode). Which registry depends on the config, so create_app sets it.
+presence = None
+
+# Joins, leaves and client count changes go out merged, once per tick, to watchers only
+presence_broadcaster = PresenceBroadcaster()
+
+# Offer/answer state per pair of peers, holding ICE candidates that arrive early
+negotiations = NegotiationTracker()
+
+# Token buckets per connection and event, against clients flooding the server
+rate_limiter = RateLimiter()
+
+# Read from the components that own them whenever /metrics is scraped
+metrics.gauge('signaling_connections', 'Authenticated socket connections', lambda: len(presence))
+metrics.gauge('signaling_chat_rooms', 'Chat rooms with members on this worker', lambda: presence.room_count())
+metrics.gauge('signaling_negotiations', 'Peer directions with offer/answer state on this worker',
+              lambda: len(negotiations))
+metrics.counter('ratelimit_dropped_total', 'Socket events dropped by the rate limiter',
+                lambda: {(('event', event),): count for event, count in rate_limiter.stats()['dropped'].items()})
+metrics.counter('ratelimit_throttled_total', 'Times a connection started being rate limited',
+                lambda: {(('event', event),): count for event, count in rate_limiter.stats()['throttled'].items()})
+metrics.counter('user_cache_hits_total', 'User cache lookups served from memory', lambda: user_cache.hits)
+metrics.counter('user_cache_misses_total', 'User cache lookups that went to MongoDB', lambda: user_cache.misses)
+metrics.gauge('user_cache_size', 'User documents in the cache', lambda: user_cache.stats()['size'])
+
+def create_app(config=Config):
+    """Build the signaling server app.
+
+    Nothing here waits on MongoDB: indexes and the availability filter are
+    prepared by a background task (see prepare_database), or ahead of time
+    with "flask create-indexes".
+    """
+    global presence
+    
+    app = Flask(__name__, static_folder='static', static_url_path='/static')
+    app.config.from_object(config)
+    CORS(app)
+    socketio.init_app(app, cors_allowed_origins="*",
+                      async_mode=app.config['SOCKETIO_ASYNC_MODE'],
+                      message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'])
+    
+    # JSON packets by default, MessagePack for clients connecting with ?serializer=msgpack
+    packet_serializers.init_app(app, socketio)
+    
+    # Polling and/or websocket, and whether websockets may be compressed
+    transport_policy.init_app(app, socketio)
+    
+    server_log.init_app(app, socketio)
+    
+    # Latency histograms and counters, scraped from /metrics
+    metrics.init_app(app)
+    
+    # Profiling behind /admin: stack sampling, slow socket events and allocation diffs
+    profiler.init_app(app)
+    slow_events.init_app(app, socketio)
+    memory_tracer.init_app(app)
+    
+    # Initialize MongoDB, timing every command
+    mongo.init_app(app, event_listeners=[metrics.mongo_listener, slow_events.mongo_listener])
+    user_cache.init_app(app)
+    availability.init_app(app)
+    
+    # Profile pictures, stored by content hash with thumbnails
+    avatar_store.init_app(app)
+    
+    # Hash passwords off the request thread, rejecting bursts with a 503
+    password_hasher.init_app(app, socketio.async_mode)
+    app.register_error_handler(HashingBusy, handle_hashing_busy)
+    
+    # Signed tokens let sockets authenticate without a database lookup
+    socket_tokens.init_app(app)
+    
+    session_journal.init_app(app, socketio)
+    login_manager.init_app(app)
+    
+    # Register blueprints
+    app.register_blueprint(auth, url_prefix='/auth')
+    app.register_blueprint(api, url_prefix='/api')
+    app.register_blueprint(avatars, url_prefix=avatar_store.url_path)
+    app.register_blueprint(admin, url_prefix='/admin')
+    app.add_url_rule('/', 'index', index)
+    app.add_url_rule('/api/users', 'get_users', get_users)
+    
+    presence = create_presence_registry(app.config['PRESENCE_STORE_URL'])
+    presence_broadcaster.init_app(app, socketio, presence, status_room=DASHBOARD_ROOM)
+    # With several workers, purge the connections of workers that died
+    presence.init_app(app, socketio, on_left=presence_broadcaster.left)
+    negotiations.init_app(app)
+    rate_limiter.init_app(app)
+    
+    # Indexes are created off the boot path, or up front with "flask create-indexes"
+    app.cli.add_command(create_indexes_command)
+    if app.config['PREPARE_DATABASE_ON_STARTUP'] or availability.enabled:
+        # A plain thread: green once serve.py has monkey patched, but a real one
+        # otherwise, where pymongo's blocking calls would stall an unpatched hub
+        threading.Thread(target=prepare_database, args=(app,), daemon=True).start()
+    
+    return app
+
+def handle_hashing_busy(error):
+    # Turn logins away quickly rather than queueing them behind a burst
+    response = jsonify({
+        'success': False,
+        'message': 'Server is busy, please try again shortly'
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.get_by_id(user_id)
 
-# Register blueprints
-app.register_blueprint(auth, url_prefix='/auth')
-app.register_blueprint(api, url_prefix='/api')
-
-# Initialize data structures
-connected_clients = {}  # Map of session_id to user_id
-active_users = {}       # Map of user_id to username
-log_messages = []
-log_queue = queue.Queue()
-
-# Create MongoDB indexes
-with app.app_context():
-    create_indexes()
-
-# HTML template for the server page
-HTML_TEMPLATE = '''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>WebRTC Signaling Server</title>
-    <style>
-        body {
-            font-family: Arial, sans-serif;
-            margin: 0;
-            padding: 20px;
-            background-color: #f5f5f5;
-        }
-        .container {
-            max-width: 800px;
-            margin: 0 auto;
-            background-color: white;
-            padding: 20px;
-            border-radius: 8px;
-            box-shadow: 0 2px 10px rgba(0, 0, 0, 0.1);
-        }
-        h1 {
-            color: #333;
-            margin-top: 0;
-        }
-        .status {
-            margin-bottom: 20px;
-            padding: 10px;
-            background-color: #e9f7ef;
-            border-radius: 4px;
-        }
-        .log-container {
-            height: 400px;
-            overflow-y: auto;
-            background-color: #f8f9fa;
-            padding: 10px;
-            border: 1px solid #ddd;
-            border-radius: 4px;
-            font-family: monospace;
-        }
-        .log-entry {
-            margin-bottom: 5px;
-            padding: 5px;
-            border-bottom: 1px solid #eee;
-        }
-        .timestamp {
-            color: #666;
-            margin-right: 10px;
-        }
-        .client-connected {
-            color: #28a745;
-        }
-        .client-disconnected {
-            color: #dc3545;
-        }
-        .signal {
-            color: #007bff;
-        }
-    </style>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.0.1/socket.io.js"></script>
-    <script>
-        document.addEventListener('DOMContentLoaded', function() {
-            const socket = io();
-            const logContainer = document.getElementById('log-container');
-            
-            socket.on('log_update', function(data) {
-                const logEntry = document.createElement('div');
-                logEntry.className = 'log-entry';
-                
-                const timestamp = document.createElement('span');
-                timestamp.className = 'timestamp';
-                timestamp.textContent = data.timestamp;
-                
-                const message = document.createElement('span');
-                message.className = data.type;
-                message.textContent = data.message;
-                
-                logEntry.appendChild(timestamp);
-                logEntry.appendChild(message);
-                logContainer.appendChild(logEntry);
-                
-                // Auto-scroll to bottom
-                logContainer.scrollTop = logContainer.scrollHeight;
-            });
-            
-            socket.on('status_update', function(data) {
-                document.getElementById('connected-clients').textContent = data.clients;
-            });
-        });
-    </script>
-</head>
-<body>
-    <div class="container">
-        <h1>WebRTC Signaling Server</h1>
-        <div class="status">
-            <p>Server Status: <strong>Running</strong></p>
-            <p>Connected Clients: <strong id="connected-clients">{{ clients }}</strong></p>
-        </div>
-        <h2>Server Logs</h2>
-        <div id="log-container" class="log-container">
-            {% for log in logs %}
-            <div class="log-entry">
-                <span class="timestamp">{{ log.timestamp }}</span>
-                <span class="{{ log.type }}">{{ log.message }}</span>
-            </div>
-            {% endfor %}
-        </div>
-    </div>
-</body>
-</html>
-'''
+def prepare_database(app, retry_interval=30):
+    """Create missing MongoDB indexes and load taken usernames/emails.
+
+    Runs in the background so a slow or unreachable MongoDB does not hold
+    up accepting sockets, retrying until it succeeds. Indexes are skipped
+    when PREPARE_DATABASE_ON_STARTUP is off, but the availability filter
+    is still warmed. Until it is warm every username and email is checked
+    against MongoDB, as it always is with several workers.
+    """
+    with app.app_context():
+        while True:
+            try:
+                if app.config['PREPARE_DATABASE_ON_STARTUP']:
+                    created = create_indexes()
+                    if created:
+                        log_message(f'Created MongoDB indexes: {", ".join(created)}')
+                warm_availability_filter()
+                return
+            except PyMongoError as e:
+                log_message(f'Preparing MongoDB failed, retrying in {retry_interval}s: {e}', "error")
+                time.sleep(retry_interval)
+
+@click.command('create-indexes')
+@with_appcontext
+def create_indexes_command():
+    """Create any MongoDB indexes that do not exist yet."""
+    created = create_indexes()
+    click.echo(f'Created {", ".join(created)}' if created else 'All indexes already exist')
 
 def log_message(message, msg_type="info"):
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = {
-        "timestamp": timestamp,
-        "message": message,
-        "type": msg_type
-    }
-    log_messages.append(log_entry)
-    log_queue.put(log_entry)
-    socketio.emit('log_update', log_entry)
+    server_log.append(message, msg_type)
+
+def watch_users(usernames):
+    """Subscribe the current client to the presence of usernames and return a snapshot"""
+    if not isinstance(usernames, list):
+        usernames = []
+    usernames = [u for u in dict.fromkeys(usernames) if isinstance(u, str) and u]
+    usernames = usernames[:current_app.config['MAX_WATCHED_USERS']]
+    for username in usernames:
+        join_room(presence_room(username))
+    version, online = presence.snapshot(usernames)
+    return {'version': version, 'online': online, 'watching': usernames}
+
+def valid_room_name(room):
+    return isinstance(room, str) and 0 < len(room) <= current_app.config['MAX_ROOM_NAME_LENGTH']
 
 @socketio.on('connect')
-def handle_connect():
+@metrics.event('connect')
+@slow_events.track('connect')
+def handle_connect(auth=None):
     client_id = request.sid
     log_message(f'Client attempting to connect. ID: {client_id}', "client-connected")
     
@@ -182,146 +211,307 @@ def handle_connect():
     emit('status', {'message': 'Connected to server, authentication required'})
 
 @socketio.on('authenticate')
+@metrics.event('authenticate')
+@slow_events.track('authenticate')
+@rate_limiter.limit('authenticate')
 def handle_authenticate(data):
     client_id = request.sid
-    user_id = data.get('user_id')
-    username = data.get('username')
     
-    if not user_id or not username:
-        emit('auth_error', {'message': 'Authentication failed: Missing user information'})
+    # The token was signed at login, so checking it needs no database round trip
+    verified = socket_tokens.verify(data.get('token'))
+    if verified is None:
+        emit('auth_error', {'message': 'Authentication failed: Invalid or expired token'})
         return
+    user_id, username, issued_at, needs_refresh = verified
     
-    # Verify user exists
-    user = User.get_by_id(user_id)
-    if not user or user.username != username:
-        emit('auth_error', {'message': 'Authentication failed: Invalid user'})
-        return
+    # Renewing is the one time the token is checked against the database
+    if needs_refresh:
+        user = User.get_by_id(user_id)
+        if user is None or not user.is_active:
+            emit('auth_error', {'message': 'Authentication failed: Account is no longer active'})
+            return
     
     # Store client connection
-    connected_clients[client_id] = user_id
-    active_users[user_id] = username
+    joined_version = presence.add(client_id, user_id, username)
     
     # Create chat session record
-    session = ChatSession(session_id=client_id, user_id=user_id)
-    session.save()
+    session_journal.open(client_id, user_id)
     
     log_message(f'Client authenticated. ID: {client_id}, User: {username}', "client-connected")
     
-    # Notify client of successful authentication
-    emit('authenticated', {
+    # Notify client of successful authentication, with the presence of its contacts
+    response = {
         'user_id': user_id,
         'username': username,
-        'active_users': list(active_users.values())
-    })
+        'presence': watch_users(data.get('contacts')),
+        # Compacted SDP formats this server relays
+        'sdp_encodings': current_app.config['SDP_ENCODINGS']
+    }
+    if needs_refresh:
+        response['token'] = socket_tokens.issue(user_id, username, issued_at)
+    emit('authenticated', response)
     
-    # Broadcast to all clients about new user
-    emit('user_joined', {
-        'username': username,
-        'active_users': list(active_users.values())
-    }, broadcast=True)
+    # Queue a presence delta for this user's watchers if this is their first connection
+    if joined_version is not None:
+        presence_broadcaster.joined(username, joined_version)
     
     # Update server status
-    socketio.emit('status_update', {'clients': len(connected_clients)})
+    presence_broadcaster.clients_changed()
 
 @socketio.on('disconnect')
+@metrics.event('disconnect')
+@slow_events.track('disconnect')
 def handle_disconnect():
     client_id = request.sid
     
-    if client_id in connected_clients:
-        user_id = connected_clients[client_id]
-        username = active_users.get(user_id, 'Unknown')
+    # Drop this connection's rate limit buckets
+    rate_limiter.forget(client_id)
+    
+    # Tell the chat rooms this connection was in
+    for room in presence.rooms_of(client_id):
+        leave_chat_room(client_id, room)
+    
+    # Remove from active connections
+    entry = presence.remove(client_id)
+    if entry:
+        user_id, username, left_version = entry
         
         # Update chat session record
-        session = ChatSession.get_by_session_id(client_id)
-        if session:
-            session.disconnected_at = datetime.utcnow()
-            session.is_active = False
-            session.save()
-        
-        # Remove from active connections
-        del connected_clients[client_id]
-        if user_id in active_users:
-            del active_users[user_id]
+        session_journal.close(client_id)
         
         log_message(f'Client disconnected. ID: {client_id}, User: {username}', "client-disconnected")
         
-        # Broadcast to all clients about user leaving
-        emit('user_left', {
-            'username': username,
-            'active_users': list(active_users.values())
-        }, broadcast=True)
+        # Queue a presence delta if that was the user's last connection
+        if left_version is not None:
+            presence_broadcaster.left(username, left_version)
+            negotiations.forget(username)
+        
+        # Update server status
+        presence_broadcaster.clients_changed()
     else:
         log_message(f'Unauthenticated client disconnected. ID: {client_id}', "client-disconnected")
+
+@socketio.on('watch')
+@metrics.event('watch')
+@slow_events.track('watch')
+@rate_limiter.limit('watch')
+def handle_watch(data):
+    # Check if client is authenticated
+    if request.sid not in presence:
+        emit('auth_error', {'message': 'Authentication required'})
+        return
     
-    # Update server status
-    socketio.emit('status_update', {'clients': len(connected_clients)})
+    emit('presence_snapshot', watch_users(data.get('usernames')))
+
+@socketio.on('unwatch')
+@metrics.event('unwatch')
+@slow_events.track('unwatch')
+@rate_limiter.limit('unwatch')
+def handle_unwatch(data):
+    usernames = data.get('usernames')
+    if not isinstance(usernames, list):
+        return
+    for username in usernames:
+        if isinstance(username, str):
+            leave_room(presence_room(username))
+
+@socketio.on('join')
+@metrics.event('join')
+@slow_events.track('join')
+@rate_limiter.limit('join')
+def handle_join(data):
+    client_id = request.sid
+    
+    # Check if client is authenticated
+    connection = presence.get(client_id)
+    if connection is None:
+        emit('auth_error', {'message': 'Authentication required'})
+        return
+    
+    room = data.get('room')
+    if not valid_room_name(room):
+        emit('room_error', {'message': 'Invalid room name'})
+        return
+    if len(presence.rooms_of(client_id)) >= current_app.config['MAX_ROOMS_PER_CONNECTION']:
+        emit('room_error', {'room': room, 'message': 'Too many rooms joined'})
+        return
+    
+    if presence.join_room(client_id, room):
+        join_room(chat_room(room))
+        emit('room_update', {'room': room, 'op': 'add', 'username': connection.username},
+             room=chat_room(room), include_self=False)
+        log_message(f'{connection.username} joined room {room}')
+    
+    emit('room_members', {'room': room, 'members': presence.room_members(room)})
+
+@socketio.on('leave')
+@metrics.event('leave')
+@slow_events.track('leave')
+@rate_limiter.limit('leave')
+def handle_leave(data):
+    room = data.get('room')
+    if valid_room_name(room):
+        leave_chat_room(request.sid, room)
+
+def leave_chat_room(client_id, room):
+    connection = presence.get(client_id)
+    if connection is None or not presence.leave_room(client_id, room):
+        return
+    leave_room(chat_room(room), sid=client_id)
+    socketio.emit('room_update', {'room': room, 'op': 'remove', 'username': connection.username},
+                  room=chat_room(room))
+    log_message(f'{connection.username} left room {room}')
 
 @socketio.on('signal')
+@metrics.event('signal')
+@slow_events.track('signal')
+@rate_limiter.limit('signal')
 def handle_signal(data):
     client_id = request.sid
     
     # Check if client is authenticated
-    if client_id not in connected_clients:
+    connection = presence.get(client_id)
+    if connection is None:
         emit('auth_error', {'message': 'Authentication required'})
         return
     
-    user_id = connected_clients[client_id]
-    username = active_users.get(user_id, 'Unknown')
+    user_id, username = connection.user_id, connection.username
     
-    # Add sender information to the signal
-    data['sender'] = {
-        'user_id': user_id,
-        'username': username
-    }
+    log_message(f'Received signal from {username}: {data.get("type")}', "signal")
     
-    log_message(f'Received signal from {username}: {data["type"]}', "signal")
+    error = compacted_sdp_error(data)
+    if error:
+        emit('signal_error', {'message': error})
+        return
     
     # If target is specified, send only to that user
     target_username = data.get('target')
     if target_username:
-        # Find the target user's client ID
-        target_user_id = None
-        for uid, uname in active_users.items():
-            if uname == target_username:
-                target_user_id = uid
-                break
-        
-        if target_user_id:
-            # Find the target client ID
-            target_client_id = None
-            for cid, uid in connected_clients.items():
-                if uid == target_user_id:
-                    target_client_id = cid
-                    break
-            
-            if target_client_id:
-                emit('signal', data, room=target_client_id)
-                return
+        if not isinstance(target_username, str):
+            emit('signal_error', {'message': 'Signal target must be a username'})
+            return
+        relay_signals(user_id, username, target_username, [data])
+        return
+    
+    # Otherwise deliver to the other members of a room the sender has joined
+    room = data.get('room')
+    if room in presence.rooms_of(client_id):
+        data['sender'] = {
+            'user_id': user_id,
+            'username': username
+        }
+        emit('signal', data, room=chat_room(room), include_self=False)
+        return
+    
+    emit('signal_error', {'message': 'Signal needs a target or a joined room'})
+
+@socketio.on('signal_batch')
+@metrics.event('signal_batch')
+@slow_events.track('signal_batch')
+@rate_limiter.limit('signal_batch')
+def handle_signal_batch(data):
+    client_id = request.sid
+    
+    # Check if client is authenticated
+    connection = presence.get(client_id)
+    if connection is None:
+        emit('auth_error', {'message': 'Authentication required'})
+        return
+    
+    user_id, username = connection.user_id, connection.username
+    signals = [signal for signal in data.get('signals') or []
+               if isinstance(signal, dict) and not compacted_sdp_error(signal)]
+    target_username = data.get('target')
     
-    # Otherwise broadcast to all other clients
-    emit('signal', data, broadcast=True, include_self=False)
+    # Batches are always addressed to a single peer
+    if not signals or not target_username:
+        return
+    if not isinstance(target_username, str):
+        emit('signal_error', {'message': 'Signal target must be a username'})
+        return
+    
+    log_message(f'Received {len(signals)} batched signals from {username}', "signal")
+    
+    # One lookup and one emit for the whole batch
+    relay_signals(user_id, username, target_username, signals)
+
+def compacted_sdp_error(signal):
+    """Why a signal's compacted SDP cannot be relayed, or None.
+
+    The compressed bytes are passed on as they are, so only the encoding
+    name is checked and the SDP itself is never decompressed or parsed.
+    """
+    encoding = signal.get('sdp_encoding')
+    if encoding is None:
+        return None
+    if encoding not in current_app.config['SDP_ENCODINGS']:
+        return f'Unsupported SDP encoding: {encoding}'
+    if not isinstance(signal.get('sdp'), bytes):
+        return 'Compacted SDP must be sent as binary'
+    return None
+
+def relay_signals(user_id, username, target_username, signals):
+    """Forward signals to the target's connection once the target can use them"""
+    target_client_id = presence.sid_for_username(target_username)
+    if target_client_id is None:
+        # Anything negotiated with a user who went offline is stale
+        negotiations.forget(target_username)
+        log_message(f'Dropped {len(signals)} signals from {username} to offline user {target_username}', "signal")
+        return
+    
+    ready = negotiations.outgoing(username, target_username, signals)
+    sender = {
+        'user_id': user_id,
+        'username': username
+    }
+    if len(ready) == 1:
+        ready[0]['sender'] = sender
+        emit('signal', ready[0], room=target_client_id)
+    elif ready:
+        # A description followed by the candidates held for it, in order
+        emit('signal_batch', {'sender': sender, 'signals': ready}, room=target_client_id)
+
+@socketio.on('join_dashboard')
+@metrics.event('join_dashboard')
+@slow_events.track('join_dashboard')
+@rate_limiter.limit('join_dashboard')
+def handle_join_dashboard():
+    # Dashboard viewers receive batched log updates in their own room
+    join_room(DASHBOARD_ROOM)
+    server_log.start_flusher()
 
 @socketio.on('get_users')
+@metrics.event('get_users')
+@slow_events.track('get_users')
+@rate_limiter.limit('get_users')
 def handle_get_users():
     client_id = request.sid
     
     # Check if client is authenticated
-    if client_id not in connected_clients:
+    if client_id not in presence:
         emit('auth_error', {'message': 'Authentication required'})
         return
     
-    emit('user_list', {'active_users': list(active_users.values())})
+    # Snapshot of the users this client watches
+    prefix = presence_room('')
+    watching = [room[len(prefix):] for room in rooms() if room.startswith(prefix)]
+    version, active_users = presence.snapshot(watching)
+    emit('user_list', {'active_users': active_users, 'version': version})
 
-@app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE, logs=log_messages, clients=len(connected_clients))
+    return render_template('index.html',
+                           logs=server_log.recent(current_app.config['LOG_PAGE_SIZE']),
+                           max_entries=current_app.config['LOG_PAGE_SIZE'],
+                           clients=len(presence))
 
-@app.route('/api/users')
 def get_users():
+    version, active_users = presence.snapshot()
     return jsonify({
-        'active_users': list(active_users.values())
+        'active_users': active_users,
+        'version': version
     })
 
 if __name__ == '__main__':
-    log_message('Signaling server running on http://localhost:5000')
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True)
+    app = create_app()
+    log_message(f"Signaling server running on http://localhost:{app.config['PORT']}")
+    socketio.run(app, host='0.0.0.0', port=app.config['PORT'], debug=app.config['DEBUG'])
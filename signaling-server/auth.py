@@ -1,12 +1,11 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
 from urllib.parse import urlsplit
-from werkzeug.utils import secure_filename
 from models import User
+from tokens import socket_tokens
+from api import upload_profile_picture
 from forms import LoginForm, RegistrationForm
 import json
-import os
-from datetime import datetime
 
 auth = Blueprint('auth', __name__)
 
@@ -26,10 +25,16 @@ def login():
             password = request.form.get('password')
             remember = request.form.get('remember', False)
         
-        user = User.get_by_email(email)
+        # Only the id and hash are needed until the password checks out
+        auth_fields = User.get_auth_fields_by_email(email)
         
-        if user and user.check_password(password):
+        if auth_fields and User.verify_password(auth_fields['password_hash'], password):
+            user = User.get_by_id(auth_fields['_id'])
             login_user(user, remember=remember)
+            
+            # Upgrade a hash made with outdated parameters while we have the password
+            if user.upgrade_password_hash(password, auth_fields['password_hash']):
+                user.save()
             next_page = request.args.get('next')
             if not next_page or urlsplit(next_page).netloc != '':
                 next_page = url_for('index')
@@ -42,7 +47,8 @@ def login():
                         'id': str(user._id),
                         'username': user.username,
                         'email': user.email
-                    }
+                    },
+                    'token': socket_tokens.issue(user._id, user.username)
                 })
             return redirect(next_page)
         
@@ -74,11 +80,10 @@ def register():
             password = request.form.get('password')
         
         # Check if username or email already exists
-        existing_user_by_username = User.get_by_username(username)
-        existing_user_by_email = User.get_by_email(email)
+        username_taken = User.exists_by_username(username)
         
-        if existing_user_by_username or existing_user_by_email:
-            if existing_user_by_username:
+        if username_taken or User.exists_by_email(email):
+            if username_taken:
                 message = 'Username already exists'
             else:
                 message = 'Email already registered'
@@ -128,13 +133,11 @@ def logout():
 
 @auth.route('/check-username/<username>')
 def check_username(username):
-    user = User.get_by_username(username)
-    return jsonify({'available': user is None})
+    return jsonify({'available': User.is_username_available(username)})
 
 @auth.route('/check-email/<email>')
 def check_email(email):
-    user = User.get_by_email(email)
-    return jsonify({'available': user is None})
+    return jsonify({'available': User.is_email_available(email)})
 
 @auth.route('/user')
 @login_required
@@ -190,53 +193,5 @@ def profile():
             }
         })
 
-@auth.route('/upload-profile-picture', methods=['POST'])
-@login_required
-def upload_profile_picture():
-    if 'profile_picture' not in request.files:
-        return jsonify({
-            'success': False,
-            'message': 'No file part'
-        }), 400
-        
-    file = request.files['profile_picture']
-    
-    if file.filename == '':
-        return jsonify({
-            'success': False,
-            'message': 'No selected file'
-        }), 400
-        
-    if file and allowed_file(file.filename):
-        # Generate a secure filename
-        filename = secure_filename(file.filename)
-        # Add timestamp to make filename unique
-        filename = f"{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{filename}"
-        
-        # Create uploads directory if it doesn't exist
-        os.makedirs('static/uploads/profile_pictures', exist_ok=True)
-        
-        # Save the file
-        file_path = os.path.join('static/uploads/profile_pictures', filename)
-        file.save(file_path)
-        
-        # Update user profile picture URL
-        current_user.profile_picture = f"/static/uploads/profile_pictures/{filename}"
-        current_user.save()
-        
-        return jsonify({
-            'success': True,
-            'message': 'Profile picture uploaded successfully',
-            'profile_picture_url': current_user.profile_picture
-        })
-    
-    return jsonify({
-        'success': False,
-        'message': 'File type not allowed'
-    }), 400
-
-# Helper function to check if file extension is allowed
-def allowed_file(filename):
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+# Same upload handling as the API
+auth.add_url_rule('/upload-profile-picture', view_func=upload_profile_picture, methods=['POST'])
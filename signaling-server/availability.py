@@ -0,0 +1,93 @@
+import hashlib
+import math
+import threading
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings.
+
+    Sized for capacity items at the given false-positive rate. Never gives
+    false negatives, so a miss proves the value was never added.
+    """
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(value))
+
+
+class AvailabilityFilter:
+    """Bloom filters of every taken username and email.
+
+    Until warm() has loaded the existing users every value is reported as
+    possibly taken, so callers fall back to the database. Values are only
+    ever added: a renamed user leaves a stale entry behind, which costs a
+    database lookup.
+
+    The filters only learn of users registered through this process after
+    warm(). With several workers (SOCKETIO_MESSAGE_QUEUE or
+    PRESENCE_STORE_URL set) a name taken on another worker would be
+    reported free, so the filter is disabled and every check goes to the
+    database.
+    """
+
+    FIELDS = ('username', 'email')
+
+    def __init__(self, capacity=1000000, error_rate=0.01):
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._lock = threading.Lock()
+        self._filters = None
+        self._pending = []  # Values added while warm() is running
+        self.enabled = True
+
+    def init_app(self, app):
+        self._capacity = app.config.get('AVAILABILITY_FILTER_CAPACITY', self._capacity)
+        self._error_rate = app.config.get('AVAILABILITY_FILTER_ERROR_RATE', self._error_rate)
+        self.enabled = not (app.config.get('SOCKETIO_MESSAGE_QUEUE') or app.config.get('PRESENCE_STORE_URL'))
+
+    def warm(self, documents):
+        """Build the filters from an iterable of user documents"""
+        filters = {field: BloomFilter(self._capacity, self._error_rate) for field in self.FIELDS}
+        for document in documents:
+            for field in self.FIELDS:
+                if document.get(field):
+                    filters[field].add(document[field])
+        with self._lock:
+            for field, value in self._pending:
+                filters[field].add(value)
+            self._pending = []
+            self._filters = filters
+
+    def add(self, field, value):
+        """Record that value is now taken for field"""
+        if not value or not self.enabled:
+            return
+        with self._lock:
+            if self._filters is None:
+                self._pending.append((field, value))
+            else:
+                self._filters[field].add(value)
+
+    def might_be_taken(self, field, value):
+        """False only when value is certainly not taken"""
+        filters = self._filters
+        if filters is None:
+            return True
+        return value in filters[field]
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from flask import Blueprint, abort, current_app, request, send_from_directory
+
+# <sha256>-<size>.webp thumbnails and <sha256>.<ext> originals
+AVATAR_NAME = re.compile(r'^[0-9a-f]{64}(?:-[0-9]+\.webp|\.(?:png|jpg|gif))$')
+ONE_YEAR = 365 * 24 * 60 * 60
+
+
+class AvatarError(Exception):
+    """An uploaded picture was rejected"""
+
+
+class AvatarTooLarge(AvatarError):
+    """An uploaded picture is over the size limit"""
+
+
+class AvatarStore:
+    """Profile pictures stored once per content hash, with square thumbnails.
+
+    Uploads are streamed to a temporary file in chunks while being hashed
+    and rejected as soon as they pass max_bytes. The original is kept as
+    <sha256>.<ext> with a <sha256>-<size>.webp thumbnail per configured
+    size next to it, so users uploading the same picture share one set of
+    files, and clients download a thumbnail instead of the original.
+
+    Every file name contains the hash of the picture, so a URL never
+    changes meaning and is served as immutable from the avatars blueprint.
+    """
+
+    EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+    FORMATS = {'PNG': 'png', 'JPEG': 'jpg', 'GIF': 'gif'}  # Pillow format -> stored extension
+    LEGACY_DIR = 'static/uploads/profile_pictures'
+    LEGACY_URL = '/static/uploads/profile_pictures/'
+
+    def __init__(self, directory='static/uploads/avatars', url_path='/avatars',
+                 max_bytes=5 * 1024 * 1024, max_pixels=25000000, sizes=(64, 128, 256),
+                 chunk_size=64 * 1024):
+        self.directory = directory
+        self.url_path = url_path
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.sizes = tuple(sizes)
+        self.chunk_size = chunk_size
+        self.legacy_dir = self.LEGACY_DIR
+
+    def init_app(self, app):
+        # Relative to the app like its static folder, whatever the working directory
+        self.directory = os.path.join(app.root_path, app.config.get('AVATAR_DIR', self.directory))
+        self.legacy_dir = os.path.join(app.root_path, self.LEGACY_DIR)
+        self.max_bytes = app.config.get('AVATAR_MAX_BYTES', self.max_bytes)
+        self.max_pixels = app.config.get('AVATAR_MAX_PIXELS', self.max_pixels)
+        self.sizes = tuple(sorted(app.config.get('AVATAR_SIZES', self.sizes)))
+
+    def allowed_file(self, filename):
+        return '.' in filename and filename.rsplit('.', 1)[1].lower() in self.EXTENSIONS
+
+    def save(self, stream):
+        """Store an uploaded picture and its thumbnails, returning its content hash"""
+        digest = hashlib.sha256()
+        size = 0
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                for chunk in iter(lambda: stream.read(self.chunk_size), b''):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise AvatarTooLarge(f'Picture is larger than {self.max_bytes // 1024} KB')
+                    digest.update(chunk)
+                    temp.write(chunk)
+            content_hash = digest.hexdigest()
+
+            # Someone already uploaded this exact picture
+            if self._original_path(content_hash) is not None:
+                return content_hash
+
+            extension = self._write_thumbnails(temp_path, content_hash)
+            os.replace(temp_path, self._path(f'{content_hash}.{extension}'))
+            return content_hash
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _write_thumbnails(self, source_path, content_hash):
+        """Check the picture and write its thumbnails, returning the original's extension"""
+        # Pillow is only needed once someone uploads a picture, not to boot
+        from PIL import Image, ImageOps
+
+        try:
+            with Image.open(source_path) as image:
+                extension = self.FORMATS.get(image.format)
+                if extension is None:
+                    raise AvatarError('File type not allowed')
+                if image.width * image.height > self.max_pixels:
+                    raise AvatarError('Picture dimensions are too large')
+                image = ImageOps.exif_transpose(image).convert('RGBA')
+                for size in self.sizes:
+                    thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+                    self._write_atomic(f'{content_hash}-{size}.webp',
+                                       lambda f: thumbnail.save(f, 'WEBP', quality=85))
+        except (OSError, Image.DecompressionBombError, SyntaxError, ValueError):
+            raise AvatarError('File is not a valid image')
+        return extension
+
+    def _write_atomic(self, name, write):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(temp_path, self._path(name))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _original_path(self, content_hash):
+        for extension in set(self.FORMATS.values()):
+            path = self._path(f'{content_hash}.{extension}')
+            if os.path.exists(path):
+                return path
+        return None
+
+    def url(self, content_hash, size=None):
+        """URL of a thumbnail, or of the original when size is None"""
+        if size is None:
+            return f'{self.url_path}/{os.path.basename(self._original_path(content_hash) or "")}'
+        return f'{self.url_path}/{content_hash}-{size}.webp'
+
+    def thumbnail_urls(self, content_hash):
+        return {str(size): self.url(content_hash, size) for size in self.sizes}
+
+    def remove(self, content_hash):
+        """Delete a picture and its thumbnails"""
+        paths = [self._path(f'{content_hash}-{size}.webp') for size in self.sizes]
+        paths.append(self._original_path(content_hash))
+        for path in paths:
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+    def remove_legacy(self, url):
+        """Delete a picture uploaded before content addressing, given its URL"""
+        if not url or not url.startswith(self.LEGACY_URL):
+            return
+        path = os.path.join(self.legacy_dir, os.path.basename(url))
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+avatar_store = AvatarStore()
+
+# Served under url_path ('/avatars')
+avatars = Blueprint('avatars', __name__)
+
+@avatars.route('/<name>')
+def serve_avatar(name):
+    """Serve a stored picture with headers that let browsers keep it for good"""
+    if not AVATAR_NAME.match(name):
+        abort(404)
+    
+    # The name is derived from the content, so it doubles as a strong ETag
+    if request.if_none_match.contains(name):
+        response = current_app.response_class(status=304)
+        response.set_etag(name)
+    else:
+        # send_file hands the file to the server's sendfile support, or to a
+        # front-end proxy as X-Sendfile when USE_X_SENDFILE is set
+        response = send_from_directory(avatar_store.directory, name, etag=name, max_age=ONE_YEAR)
+    
+    response.cache_control.public = True
+    response.cache_control.max_age = ONE_YEAR
+    response.cache_control.immutable = True
+    return response
@@ -0,0 +1,6 @@
+"""Benchmarks for the signaling server.
+
+Each module is runnable on its own from the signaling-server directory,
+e.g. ``python -m benchmarks.concurrency``. They talk to the MongoDB at
+MONGO_URI and clean up the users they seed.
+"""
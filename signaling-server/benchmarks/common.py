@@ -0,0 +1,158 @@
+"""Helpers shared by the benchmarks"""
+import asyncio
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import pymongo
+import socketio
+from bson.objectid import ObjectId
+from flask import Flask
+
+from config import Config
+from tokens import DEFAULT_SECRET_KEYS, SocketTokens
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Servers started without DEBUG refuse the example key, so sign with a throwaway one
+if Config.SECRET_KEY in DEFAULT_SECRET_KEYS:
+    Config.SECRET_KEY = os.environ['SECRET_KEY'] = secrets.token_hex(16)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(('127.0.0.1', port)) == 0:
+                return True
+        time.sleep(0.05)
+    return False
+
+
+def start_server(entry='serve.py', **env_overrides):
+    """Start a signaling server process and return (port, process)"""
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), FLASK_DEBUG='0', **env_overrides)
+    process = subprocess.Popen([sys.executable, entry], cwd=SERVER_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not wait_for_port(port):
+        process.kill()
+        raise RuntimeError(f'{entry} did not start listening on port {port}')
+    return port, process
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def process_rss(pid):
+    """Resident set size of a process in bytes (Linux only)"""
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def process_cpu_seconds(pid):
+    """User plus system CPU time of a process in seconds (Linux only)"""
+    with open(f'/proc/{pid}/stat') as stat:
+        # Fields after the parenthesised command name; utime and stime are 14 and 15
+        fields = stat.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def users_collection(mongo_uri=None):
+    client = pymongo.MongoClient(mongo_uri or Config.MONGO_URI)
+    return client.get_default_database().users
+
+
+def seed_users(count, collection=None):
+    """Insert count throwaway users and return [(user_id, username)]"""
+    collection = collection if collection is not None else users_collection()
+    run_id = uuid.uuid4().hex[:8]
+    docs = []
+    for i in range(count):
+        username = f'bench-{run_id}-{i}'
+        docs.append({
+            '_id': ObjectId(),
+            'username': username,
+            'email': f'{username}@example.com',
+            'password_hash': '!',
+            'created_at': datetime.utcnow(),
+            'last_login': None,
+            'is_active': True,
+        })
+    if docs:
+        collection.insert_many(docs)
+    return [(str(doc['_id']), doc['username']) for doc in docs]
+
+
+def remove_users(users, collection=None):
+    collection = collection if collection is not None else users_collection()
+    collection.delete_many({'_id': {'$in': [ObjectId(uid) for uid, _ in users]}})
+
+
+def socket_tokens():
+    """Token signer with the server's SECRET_KEY, as /api/login uses it"""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    tokens = SocketTokens()
+    tokens.init_app(app)
+    return tokens
+
+
+_tokens = None
+
+
+async def connect_user(url, user_id, username, timeout=10, transports=None, **client_kwargs):
+    """Connect and authenticate one user, returning the client or None"""
+    global _tokens
+    if _tokens is None:
+        _tokens = socket_tokens()
+    client = socketio.AsyncClient(reconnection=False, **client_kwargs)
+    authenticated = asyncio.get_running_loop().create_future()
+
+    @client.on('authenticated')
+    async def on_authenticated(data):
+        if not authenticated.done():
+            authenticated.set_result(True)
+
+    @client.on('auth_error')
+    async def on_auth_error(data):
+        if not authenticated.done():
+            authenticated.set_result(False)
+
+    try:
+        await client.connect(url, transports=transports, wait_timeout=timeout)
+        await client.emit('authenticate', {'token': _tokens.issue(user_id, username)})
+        if await asyncio.wait_for(authenticated, timeout):
+            return client
+    except Exception:
+        pass
+    await client.disconnect()
+    return None
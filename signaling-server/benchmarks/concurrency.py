@@ -0,0 +1,95 @@
+"""How many authenticated sockets a single server process holds per async mode.
+
+For each mode the server is started through serve.py and clients are added
+in steps, each one connecting and completing 'authenticate'. A step counts
+as held when at least --min-success of its clients authenticate within the
+timeout; the ramp stops at the first step that fails or at --max-clients.
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.concurrency --modes threading eventlet gevent --max-clients 5000
+"""
+import argparse
+import asyncio
+import json
+import resource
+import time
+
+from benchmarks.common import (connect_user, process_rss, remove_users, seed_users,
+                               start_server, stop_server)
+
+
+async def ramp(port, users, step, min_success, timeout):
+    url = f'http://127.0.0.1:{port}'
+    held = []
+    steps = []
+    for start in range(0, len(users), step):
+        batch = users[start:start + step]
+        began = time.perf_counter()
+        clients = await asyncio.gather(*(
+            connect_user(url, user_id, username, timeout=timeout)
+            for user_id, username in batch))
+        elapsed = time.perf_counter() - began
+        connected = [client for client in clients if client is not None]
+        held.extend(connected)
+        steps.append({
+            'attempted': len(batch),
+            'authenticated': len(connected),
+            'seconds': round(elapsed, 3),
+        })
+        if len(connected) < len(batch) * min_success:
+            break
+    return held, steps
+
+
+async def run_mode(mode, users, args):
+    port, process = start_server(SOCKETIO_ASYNC_MODE=mode)
+    try:
+        base_rss = process_rss(process.pid)
+        held, steps = await ramp(port, users, args.step, args.min_success, args.timeout)
+        rss = process_rss(process.pid)
+        result = {
+            'mode': mode,
+            'held': len(held),
+            'steps': steps,
+            'server_rss_bytes': rss,
+            'bytes_per_socket': (rss - base_rss) // len(held) if held else None,
+        }
+        await asyncio.gather(*(client.disconnect() for client in held))
+        return result
+    finally:
+        stop_server(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['threading', 'eventlet', 'gevent'])
+    parser.add_argument('--max-clients', type=int, default=2000)
+    parser.add_argument('--step', type=int, default=250)
+    parser.add_argument('--min-success', type=float, default=0.99)
+    parser.add_argument('--timeout', type=float, default=20)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results only')
+    args = parser.parse_args()
+
+    # Every client holds a socket in this process as well as in the server
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    users = seed_users(args.max_clients)
+    try:
+        results = [asyncio.run(run_mode(mode, users, args)) for mode in args.modes]
+    finally:
+        remove_users(users)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':<10} {'held':>8} {'server RSS':>12} {'bytes/socket':>14}")
+    for result in results:
+        per_socket = result['bytes_per_socket']
+        print(f"{result['mode']:<10} {result['held']:>8} "
+              f"{result['server_rss_bytes'] / 2**20:>10.1f}MB "
+              f"{per_socket if per_socket is not None else '-':>14}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Bytes of in-memory presence state per connected user.
+
+Fills a PresenceRegistry with --sizes users, each connected from --tabs
+sockets and joined to --rooms chat rooms, and reports what tracemalloc
+sees allocated per user. User ids and usernames are decoded from a JSON
+token payload for every connection, as the server does, so any copy of
+them the registry keeps shows up in the total. Socket ids belong to the
+Socket.IO server and are made before measuring.
+
+    python -m benchmarks.memory --sizes 10000 100000 --tabs 2
+"""
+import argparse
+import gc
+import json
+import os
+import tracemalloc
+
+from bson.objectid import ObjectId
+
+from presence import PresenceRegistry
+
+
+def measure(users, tabs, rooms):
+    payloads = [json.dumps([str(ObjectId()), f'user{i:07d}']) for i in range(users)]
+    sids = [[os.urandom(10).hex() for _ in range(tabs)] for _ in range(users)]
+    room_names = [f'room{i}' for i in range(max(1, users // 10))]
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    registry = PresenceRegistry()
+    for i, (payload, user_sids) in enumerate(zip(payloads, sids)):
+        for sid in user_sids:
+            user_id, username = json.loads(payload)
+            registry.add(sid, user_id, username)
+            for k in range(rooms):
+                registry.join_room(sid, room_names[(i + k) % len(room_names)])
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    total = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    assert len(registry) == users * tabs
+    return {
+        'users': users,
+        'connections': users * tabs,
+        'rooms_per_connection': rooms,
+        'bytes': total,
+        'bytes_per_user': total // users,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--tabs', type=int, default=1, help='connections per user')
+    parser.add_argument('--rooms', type=int, default=0, help='chat rooms joined per connection')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results only')
+    args = parser.parse_args()
+
+    results = [measure(users, args.tabs, args.rooms) for users in args.sizes]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'users':>8} {'connections':>12} {'total':>10} {'bytes/user':>12}")
+    for result in results:
+        print(f"{result['users']:>8} {result['connections']:>12} "
+              f"{result['bytes'] / 2**20:>8.1f}MB {result['bytes_per_user']:>12}")
+
+
+if __name__ == '__main__':
+    main()
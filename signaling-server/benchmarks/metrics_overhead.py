@@ -0,0 +1,67 @@
+"""Cost of the metrics instrumentation per socket event.
+
+Calls a no-op handler --events times with and without the metrics.event()
+decorator, spread over --series event names, and reports the difference
+per call. Also times recording a Mongo command through the listener and
+rendering /metrics with every series populated.
+
+    python -m benchmarks.metrics_overhead --events 1000000
+"""
+import argparse
+import json
+import time
+from types import SimpleNamespace
+
+from metrics import Metrics
+
+
+def per_call(fn, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - started) / calls
+
+
+def handler():
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--series', type=int, default=11, help='distinct event names')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results only')
+    args = parser.parse_args()
+
+    metrics = Metrics()
+    timed = [metrics.event(f'event{i}')(handler) for i in range(args.series)]
+    calls = args.events // args.series
+
+    bare = sum(per_call(handler, calls) for _ in timed) / len(timed)
+    instrumented = sum(per_call(fn, calls) for fn in timed) / len(timed)
+
+    command = SimpleNamespace(command_name='find', duration_micros=850)
+    mongo = per_call(lambda: metrics.mongo_listener.succeeded(command), calls)
+
+    started = time.perf_counter()
+    body = metrics.render()
+    render = time.perf_counter() - started
+
+    results = {
+        'events': calls * len(timed),
+        'bare_handler_us': round(bare * 1e6, 3),
+        'instrumented_handler_us': round(instrumented * 1e6, 3),
+        'overhead_per_event_us': round((instrumented - bare) * 1e6, 3),
+        'mongo_command_us': round(mongo * 1e6, 3),
+        'render_ms': round(render * 1e3, 3),
+        'render_bytes': len(body),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for key, value in results.items():
+        print(f'{key:<26} {value}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""JSON vs MessagePack Socket.IO packets for relayed signals.
+
+Builds the packets the server handles when relaying an offer, an answer
+and a trickled ICE candidate: the one the sender's client sends, and the
+one the server emits to the target with the sender added. Reports the
+bytes on the wire for both and the server's CPU per relayed signal, i.e.
+decoding the incoming packet plus encoding the outgoing one.
+
+    python -m benchmarks.serializers --rounds 20000
+"""
+import argparse
+import json
+import time
+
+from socketio import packet
+
+from benchmarks.signaling import make_candidate, make_sdp
+from serializer import NegotiatedPacket, encode_msgpack
+
+
+def signals():
+    candidate = dict(make_candidate(1), type='candidate', target='bob')
+    return {
+        'offer': {'type': 'offer', 'target': 'bob', 'sdp': make_sdp('offer', 4611686018427387904)},
+        'answer': {'type': 'answer', 'target': 'bob', 'sdp': make_sdp('answer', 4611686018427387905)},
+        'candidate': candidate,
+    }
+
+
+def relayed(signal):
+    """The packets received from the sender and emitted to the target"""
+    outgoing = {key: value for key, value in signal.items() if key != 'target'}
+    outgoing['sender'] = {'user_id': '64b7f0c2a1e4d93f2c8b4567', 'username': 'alice'}
+    return (packet.Packet(packet.EVENT, data=['signal', signal], namespace='/'),
+            packet.Packet(packet.EVENT, data=['signal', outgoing], namespace='/'))
+
+
+def per_call(fn, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - started) / rounds
+
+
+def measure(incoming, outgoing, rounds):
+    json_in = incoming.encode()
+    msgpack_in = encode_msgpack(incoming)
+    json_us = per_call(lambda: (packet.Packet(encoded_packet=json_in), outgoing.encode()), rounds)
+    msgpack_us = per_call(lambda: (NegotiatedPacket(encoded_packet=msgpack_in), encode_msgpack(outgoing)),
+                          rounds)
+    return {
+        'json_bytes_in': len(json_in.encode('utf-8')),
+        'json_bytes_out': len(outgoing.encode().encode('utf-8')),
+        'msgpack_bytes_in': len(msgpack_in),
+        'msgpack_bytes_out': len(encode_msgpack(outgoing)),
+        'json_relay_us': round(json_us * 1e6, 3),
+        'msgpack_relay_us': round(msgpack_us * 1e6, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20000)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results only')
+    args = parser.parse_args()
+
+    results = {kind: measure(*relayed(signal), args.rounds) for kind, signal in signals().items()}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    columns = list(next(iter(results.values())))
+    print(f'{"":<10} ' + ' '.join(f'{column:>17}' for column in columns))
+    for kind, result in results.items():
+        print(f'{kind:<10} ' + ' '.join(f'{result[column]:>17}' for column in columns))
+
+
+if __name__ == '__main__':
+    main()
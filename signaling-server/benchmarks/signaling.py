@@ -0,0 +1,335 @@
+"""Signaling load generator and relay latency benchmark.
+
+Seeds --users users, connects one python-socketio client per user and
+authenticates it, then pairs the users up and replays a call setup between
+every pair at once: an offer, an answer and --candidates trickled ICE
+candidates in each direction, sent either one 'signal' per candidate or as
+a single 'signal_batch' (--batch).
+
+Reports connect throughput and latency, p50/p99 relay and call setup
+(offer sent to answer received) latency, server memory per connection and
+server CPU per relayed message as JSON, so results can be compared between
+commits or configurations:
+
+    python -m benchmarks.signaling --users 200 --mongomock --output before.json
+    python -m benchmarks.signaling --users 200 --mongomock --transports websocket --compact-sdp
+
+--transports sets both what the clients connect with and the server's
+SOCKETIO_TRANSPORTS; --compact-sdp sends offers and answers deflated, as
+webrtc.js does when both peers support it.
+
+With --mongomock the server runs in a child process on an in-memory
+mongomock database; otherwise it uses MONGO_URI like the server itself.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import zlib
+
+from benchmarks.common import (connect_user, free_port, percentile, process_cpu_seconds,
+                               process_rss, remove_users, seed_users, start_server,
+                               stop_server, wait_for_port)
+
+SDP_CODECS = [
+    (111, 'opus/48000/2'), (63, 'red/48000/2'), (9, 'G722/8000'), (0, 'PCMU/8000'),
+    (8, 'PCMA/8000'), (13, 'CN/8000'), (110, 'telephone-event/48000'), (126, 'telephone-event/8000'),
+]
+SDP_EXTMAPS = [
+    'urn:ietf:params:rtp-hdrext:ssrc-audio-level',
+    'http://www.webrtc.org/experiments/rtp-hdrext/abs-send-time',
+    'http://www.ietf.org/id/draft-holmer-rmcat-transport-wide-cc-extensions-01',
+    'urn:ietf:params:rtp-hdrext:sdes:mid',
+]
+
+
+def make_sdp(kind, session_id):
+    """A browser-like SDP with a data channel and an audio section"""
+    setup = 'actpass' if kind == 'offer' else 'active'
+    payloads = ' '.join(str(pt) for pt, _ in SDP_CODECS)
+    lines = [
+        'v=0', f'o=- {session_id} 2 IN IP4 127.0.0.1', 's=-', 't=0 0',
+        'a=group:BUNDLE 0 1', 'a=extmap-allow-mixed', 'a=msid-semantic: WMS',
+        'm=application 9 UDP/DTLS/SCTP webrtc-datachannel', 'c=IN IP4 0.0.0.0',
+        'a=ice-ufrag:Xk3f', 'a=ice-pwd:9fJ2kQx8vL0aP1sT6yN4mB7c', 'a=ice-options:trickle',
+        'a=fingerprint:sha-256 ' + ':'.join(['A1', 'B2', 'C3', 'D4'] * 8),
+        f'a=setup:{setup}', 'a=mid:0', 'a=sctp-port:5000', 'a=max-message-size:262144',
+        f'm=audio 9 UDP/TLS/RTP/SAVPF {payloads}', 'c=IN IP4 0.0.0.0', 'a=rtcp:9 IN IP4 0.0.0.0',
+        'a=ice-ufrag:Xk3f', 'a=ice-pwd:9fJ2kQx8vL0aP1sT6yN4mB7c', 'a=ice-options:trickle',
+        'a=fingerprint:sha-256 ' + ':'.join(['A1', 'B2', 'C3', 'D4'] * 8),
+        f'a=setup:{setup}', 'a=mid:1', 'a=sendrecv', 'a=rtcp-mux',
+    ]
+    lines += [f'a=extmap:{i} {uri}' for i, uri in enumerate(SDP_EXTMAPS, 1)]
+    for pt, codec in SDP_CODECS:
+        lines.append(f'a=rtpmap:{pt} {codec}')
+        lines.append(f'a=rtcp-fb:{pt} transport-cc')
+    lines.append('a=fmtp:111 minptime=10;useinbandfec=1')
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def make_candidate(index):
+    return {
+        'candidate': (f'candidate:{842163049 + index} 1 udp {2122260223 - index} '
+                      f'192.0.2.{index % 250 + 1} {50000 + index} typ host generation 0 '
+                      f'ufrag Xk3f network-id 1'),
+        'sdpMid': '0',
+        'sdpMLineIndex': 0,
+    }
+
+
+def describe(kind, session_id, compact):
+    """An offer or answer signal, with the SDP deflated if compact"""
+    sdp = make_sdp(kind, session_id)
+    if not compact:
+        return {'type': kind, 'sdp': sdp}
+    deflate = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return {'type': kind, 'sdp': deflate.compress(sdp.encode('utf-8')) + deflate.flush(),
+            'sdp_encoding': 'deflate-raw'}
+
+
+def _mock_server(port, async_mode, transports, user_count, conn):
+    """Child process: run the server on mongomock and hand back the seeded users"""
+    if async_mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif async_mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+    os.environ.update(PORT=str(port), FLASK_DEBUG='0', SOCKETIO_ASYNC_MODE=async_mode,
+                      SOCKETIO_TRANSPORTS=transports)
+
+    import flask_pymongo
+    import mongomock
+    flask_pymongo.MongoClient = mongomock.MongoClient
+
+    from app import create_app, socketio
+    from models import mongo
+
+    app = create_app()
+
+    conn.send(seed_users(user_count, mongo.db.users))
+    conn.close()
+    socketio.run(app, host='127.0.0.1', port=port, debug=False)
+
+
+class Server:
+    """The signaling server under test, in a child process"""
+
+    def __init__(self, args):
+        self.args = args
+        self.users = []
+        self._process = None
+        self._popen = None
+
+    def start(self):
+        if self.args.mongomock:
+            self.port = free_port()
+            parent_conn, child_conn = multiprocessing.Pipe()
+            self._process = multiprocessing.get_context('spawn').Process(
+                target=_mock_server,
+                args=(self.port, self.args.async_mode, self.args.transports, self.args.users, child_conn),
+                daemon=True)
+            self._process.start()
+            self.users = parent_conn.recv()
+            if not wait_for_port(self.port):
+                raise RuntimeError('Benchmark server did not start')
+            self.pid = self._process.pid
+        else:
+            self.users = seed_users(self.args.users)
+            self.port, self._popen = start_server(SOCKETIO_ASYNC_MODE=self.args.async_mode,
+                                                  SOCKETIO_TRANSPORTS=self.args.transports)
+            self.pid = self._popen.pid
+        self.url = f'http://127.0.0.1:{self.port}'
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+        if self._popen is not None:
+            stop_server(self._popen)
+            remove_users(self.users)
+
+
+class Peer:
+    """One connected user, recording when each relayed signal arrives"""
+
+    def __init__(self, client, username):
+        self.client = client
+        self.username = username
+        self.latencies = []
+        self.received = 0
+        self.answer_event = asyncio.Event()
+        self.offer_event = asyncio.Event()
+        client.on('signal', self._on_signal)
+        client.on('signal_batch', self._on_signal_batch)
+
+    def _record(self, signal):
+        self.latencies.append(time.perf_counter() - signal['sent_at'])
+        self.received += 1
+        if signal['type'] == 'offer':
+            self.offer_event.set()
+        elif signal['type'] == 'answer':
+            self.answer_event.set()
+
+    async def _on_signal(self, data):
+        self._record(data)
+
+    async def _on_signal_batch(self, data):
+        for signal in data['signals']:
+            self._record(signal)
+
+    async def send(self, target, signal):
+        signal['target'] = target
+        signal['sent_at'] = time.perf_counter()
+        await self.client.emit('signal', signal)
+
+    async def send_candidates(self, target, count, batch):
+        candidates = [{'type': 'candidate', 'candidate': make_candidate(i)} for i in range(count)]
+        if batch:
+            now = time.perf_counter()
+            for signal in candidates:
+                signal['sent_at'] = now
+            await self.client.emit('signal_batch', {'target': target, 'signals': candidates})
+        else:
+            for signal in candidates:
+                await self.send(target, signal)
+
+
+async def call_setup(caller, callee, args):
+    """Offer, answer and trickled candidates in both directions; returns offer-to-answer seconds"""
+    began = time.perf_counter()
+    await caller.send(callee.username, describe('offer', id(caller), args.compact_sdp))
+    await caller.send_candidates(callee.username, args.candidates, args.batch)
+    await asyncio.wait_for(callee.offer_event.wait(), args.timeout)
+    await callee.send(caller.username, describe('answer', id(callee), args.compact_sdp))
+    await callee.send_candidates(caller.username, args.candidates, args.batch)
+    await asyncio.wait_for(caller.answer_event.wait(), args.timeout)
+    return time.perf_counter() - began
+
+
+async def timed_connect(url, user_id, username, args):
+    began = time.perf_counter()
+    client = await connect_user(url, user_id, username, timeout=args.timeout,
+                                transports=args.transports.split(','))
+    return client, time.perf_counter() - began
+
+
+def latency_summary(latencies):
+    return {
+        'p50': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        'p99': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'max': round(max(latencies) * 1000, 3) if latencies else None,
+    }
+
+
+async def run_benchmark(server, args):
+    rss_before = process_rss(server.pid)
+
+    # Connect phase
+    began = time.perf_counter()
+    connected = await asyncio.gather(*(
+        timed_connect(server.url, user_id, username, args)
+        for user_id, username in server.users))
+    connect_seconds = time.perf_counter() - began
+    peers = [Peer(client, username)
+             for (client, _), (_, username) in zip(connected, server.users) if client is not None]
+    connect_latencies = [seconds for client, seconds in connected if client is not None]
+    rss_connected = process_rss(server.pid)
+
+    # Relay phase
+    expected = len(peers) // 2 * 2 * (1 + args.candidates)
+    cpu_before = process_cpu_seconds(server.pid)
+    began = time.perf_counter()
+    pairs = list(zip(peers[0::2], peers[1::2]))
+    setups = await asyncio.gather(*(call_setup(a, b, args) for a, b in pairs),
+                                  return_exceptions=True)
+    deadline = time.perf_counter() + args.timeout
+    while sum(peer.received for peer in peers) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    relay_seconds = time.perf_counter() - began
+    cpu_used = process_cpu_seconds(server.pid) - cpu_before
+
+    await asyncio.gather(*(peer.client.disconnect() for peer in peers))
+
+    latencies = [latency for peer in peers for latency in peer.latencies]
+    setup_latencies = [result for result in setups if not isinstance(result, Exception)]
+    relayed = len(latencies)
+    events = len(pairs) * 2 * (2 if args.batch else 1 + args.candidates)
+    return {
+        'config': {
+            'users': args.users,
+            'candidates': args.candidates,
+            'batch': args.batch,
+            'transports': args.transports,
+            'compact_sdp': args.compact_sdp,
+            'async_mode': args.async_mode,
+            'mongomock': args.mongomock,
+            'python': platform.python_version(),
+        },
+        'connect': {
+            'attempted': len(server.users),
+            'authenticated': len(peers),
+            'seconds': round(connect_seconds, 4),
+            'per_second': round(len(peers) / connect_seconds, 1) if connect_seconds else None,
+            'latency_ms': latency_summary(connect_latencies),
+        },
+        'relay': {
+            'pairs': len(pairs),
+            'failed_setups': sum(isinstance(result, Exception) for result in setups),
+            'signals_expected': expected,
+            'signals_relayed': relayed,
+            'socket_events_sent': events,
+            'seconds': round(relay_seconds, 4),
+            'latency_ms': latency_summary(latencies),
+            'setup_ms': latency_summary(setup_latencies),
+        },
+        'server': {
+            'rss_bytes': rss_connected,
+            'bytes_per_connection': (rss_connected - rss_before) // len(peers) if peers else None,
+            'cpu_seconds': round(cpu_used, 4),
+            'cpu_us_per_signal': round(cpu_used / relayed * 1e6, 2) if relayed else None,
+            'cpu_us_per_event': round(cpu_used / events * 1e6, 2) if events else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--candidates', type=int, default=8, help='ICE candidates per side')
+    parser.add_argument('--batch', action='store_true', help="send candidates with 'signal_batch'")
+    parser.add_argument('--async-mode', default='eventlet', choices=['eventlet', 'gevent', 'threading'])
+    parser.add_argument('--transports', default='polling,websocket',
+                        help="client transports and server SOCKETIO_TRANSPORTS, e.g. 'websocket'")
+    parser.add_argument('--compact-sdp', action='store_true', help='send offers and answers deflated')
+    parser.add_argument('--mongomock', action='store_true', help='run the server on an in-memory database')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--output', help='write the JSON results to this file')
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    server = Server(args)
+    server.start()
+    try:
+        results = asyncio.run(run_benchmark(server, args))
+    finally:
+        server.stop()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+    if results['relay']['signals_relayed'] < results['relay']['signals_expected']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
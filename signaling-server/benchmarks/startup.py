@@ -0,0 +1,96 @@
+"""Cold-boot time of the signaling server, up to its first accepted socket.
+
+Starts serve.py --runs times per async mode and records how long after
+spawning the process its port starts listening, and how long until a
+Socket.IO client is connected and has received the server's 'status'
+greeting. MongoDB does not have to be reachable: nothing on the boot path
+waits for it.
+
+    python -m benchmarks.startup --modes threading eventlet --runs 5
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import socketio
+
+from benchmarks.common import SERVER_DIR, free_port, stop_server
+
+
+def port_open(port):
+    with socket.socket() as sock:
+        return sock.connect_ex(('127.0.0.1', port)) == 0
+
+
+def first_socket(url, timeout):
+    """Connect a client and wait for the server's greeting, returning False on failure"""
+    greeted = threading.Event()
+    client = socketio.Client(reconnection=False)
+    client.on('status', lambda data: greeted.set())
+    try:
+        client.connect(url, wait_timeout=timeout)
+        return greeted.wait(timeout)
+    except socketio.exceptions.ConnectionError:
+        return False
+    finally:
+        client.disconnect()
+
+
+def boot(mode, timeout):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), FLASK_DEBUG='0', SOCKETIO_ASYNC_MODE=mode)
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'serve.py'], cwd=SERVER_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = started + timeout
+        while not port_open(port):
+            if time.perf_counter() > deadline or process.poll() is not None:
+                return None
+            time.sleep(0.005)
+        listening = time.perf_counter() - started
+        while not first_socket(f'http://127.0.0.1:{port}', timeout=2):
+            if time.perf_counter() > deadline:
+                return None
+        return {'listening': listening, 'first_socket': time.perf_counter() - started}
+    finally:
+        stop_server(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['threading', 'eventlet', 'gevent'])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results only')
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        runs = [boot(mode, args.timeout) for _ in range(args.runs)]
+        booted = [run for run in runs if run is not None]
+        results.append({
+            'mode': mode,
+            'runs': args.runs,
+            'failed': args.runs - len(booted),
+            'listening_s': round(statistics.median(r['listening'] for r in booted), 3) if booted else None,
+            'first_socket_s': round(statistics.median(r['first_socket'] for r in booted), 3) if booted else None,
+        })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':<10} {'listening':>10} {'first socket':>13} {'failed':>7}")
+    for result in results:
+        print(f"{result['mode']:<10} {result['listening_s'] or '-':>10} "
+              f"{result['first_socket_s'] or '-':>13} {result['failed']:>7}")
+
+
+if __name__ == '__main__':
+    main()
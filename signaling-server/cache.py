@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class UserCache:
+    """Bounded LRU cache of user documents, minus password hashes, with a time-to-live.
+
+    Documents are stored once per user id and can also be found by username
+    or email through secondary keys. Callers build a fresh User from the
+    cached document, so request-local changes to a User never leak into
+    the cache. Writes must call invalidate(); across several workers the
+    TTL bounds how long another worker can serve a stale copy.
+    """
+
+    LOOKUP_FIELDS = ('username', 'email')
+
+    def __init__(self, max_size=10000, ttl=60):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # Map of user_id to (expires_at, document)
+        self._ids_by_key = {}          # Map of (field, value) to user_id
+        self._max_size = max_size
+        self._ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self._max_size = app.config.get('USER_CACHE_SIZE', self._max_size)
+        self._ttl = app.config.get('USER_CACHE_TTL', self._ttl)
+
+    def get(self, field, value):
+        """Return the cached document whose field ('_id', 'username' or 'email') equals value"""
+        with self._lock:
+            if field == '_id':
+                user_id = str(value)
+            else:
+                user_id = self._ids_by_key.get((field, value))
+            entry = self._entries.get(user_id) if user_id is not None else None
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(user_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, document):
+        """Cache a user document fetched from the database"""
+        if self._max_size <= 0:
+            return
+        user_id = str(document['_id'])
+        with self._lock:
+            self._remove(user_id)
+            self._entries[user_id] = (time.monotonic() + self._ttl, document)
+            for field in self.LOOKUP_FIELDS:
+                if document.get(field) is not None:
+                    self._ids_by_key[(field, document[field])] = user_id
+            while len(self._entries) > self._max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, user_id):
+        """Drop a user's document and all keys pointing to it"""
+        with self._lock:
+            self._remove(str(user_id))
+
+    def _remove(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        for field in self.LOOKUP_FIELDS:
+            key = (field, entry[1].get(field))
+            if self._ids_by_key.get(key) == user_id:
+                del self._ids_by_key[key]
+
+    def stats(self):
+        """Return hit/miss counters and occupancy, for sizing the cache"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'size': len(self._entries),
+            'max_size': self._max_size,
+            'ttl': self._ttl
+        }
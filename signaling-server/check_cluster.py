@@ -0,0 +1,257 @@
+"""Check that signals and presence updates cross worker boundaries.
+
+Starts a local Redis stand-in (fakeredis, unless --redis-url is given),
+launches several signaling workers against it as the Socket.IO message
+queue and presence store, connects one test user to each worker and sends
+a targeted signal between every pair of users on different workers. The
+first user watches all the others, and every user joins one chat room to
+exchange a room signal. Two users on different workers then restart a
+negotiation with a new offer, and the callee's next candidate has to wait
+for its new answer. Finally a user registers through one worker and
+every other worker must report the username and email as taken.
+
+Workers use MONGO_URI like the server itself, so MongoDB must be running.
+
+    pip install "fakeredis[lua]" redis
+    python check_cluster.py --workers 3
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import requests
+import socketio
+from flask import Flask
+
+from benchmarks.common import free_port, wait_for_port  # Also sets a throwaway SECRET_KEY if needed
+from config import Config
+from models import mongo, User
+from tokens import socket_tokens
+
+
+def start_broker():
+    """Start an in-process Redis stand-in and return its URL"""
+    from fakeredis import TcpFakeServer
+
+    port = free_port()
+    server = TcpFakeServer(('127.0.0.1', port), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'redis://127.0.0.1:{port}/0'
+
+
+def start_workers(count, broker_url):
+    """Launch count signaling workers and return [(port, process)]"""
+    workers = []
+    here = os.path.dirname(os.path.abspath(__file__))
+    for _ in range(count):
+        port = free_port()
+        env = dict(os.environ,
+                   PORT=str(port),
+                   FLASK_DEBUG='0',
+                   SOCKETIO_ASYNC_MODE=os.environ.get('SOCKETIO_ASYNC_MODE', 'threading'),
+                   SOCKETIO_MESSAGE_QUEUE=broker_url,
+                   PRESENCE_STORE_URL=broker_url)
+        # serve.py monkey patches for eventlet/gevent before the app is imported
+        process = subprocess.Popen([sys.executable, 'serve.py'], cwd=here, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        workers.append((port, process))
+    for port, process in workers:
+        if not wait_for_port(port):
+            raise RuntimeError(f'Worker on port {port} did not start')
+    return workers
+
+
+def seed_users(count):
+    """Create count throwaway users and return [(user_id, username)]"""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    mongo.init_app(app)
+    socket_tokens.init_app(app)
+    run_id = uuid.uuid4().hex[:8]
+    users = []
+    for i in range(count):
+        username = f'cluster-{run_id}-{i}'
+        user = User(username=username, email=f'{username}@example.com', password_hash='!')
+        user.save()
+        users.append((str(user._id), username))
+    return users
+
+
+def remove_users(users):
+    from bson.objectid import ObjectId
+
+    mongo.db.users.delete_many({'_id': {'$in': [ObjectId(uid) for uid, _ in users]}})
+
+
+class TestUser:
+    """A Socket.IO client authenticated as one user on one worker"""
+
+    def __init__(self, port, user_id, username, contacts=()):
+        self.username = username
+        self.signals = []
+        self.joined = set()
+        self.room_members = set()
+        self.authenticated = threading.Event()
+        self.client = socketio.Client()
+        self.client.on('authenticated', self._on_authenticated)
+        self.client.on('signal', lambda data: self.signals.append(data))
+        self.client.on('signal_batch', lambda data: self.signals.extend(data['signals']))
+        self.client.on('presence_update', self._on_presence_update)
+        self.client.on('room_members', lambda data: self.room_members.update(data['members']))
+        self.client.on('room_update', self._on_room_update)
+        self.client.connect(f'http://127.0.0.1:{port}')
+        self.client.emit('authenticate', {'token': socket_tokens.issue(user_id, username),
+                                          'contacts': list(contacts)})
+
+    def _on_authenticated(self, data):
+        # Contacts already online arrive in the snapshot rather than as updates
+        self.joined.update(data['presence']['online'])
+        self.authenticated.set()
+
+    def _on_presence_update(self, data):
+        self.joined.update(username for _, op, username in data['changes'] if op == 'add')
+
+    def _on_room_update(self, data):
+        if data['op'] == 'add':
+            self.room_members.add(data['username'])
+        else:
+            self.room_members.discard(data['username'])
+
+    def wait_until(self, predicate, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if predicate():
+                return True
+            time.sleep(0.05)
+        return False
+
+
+def run_check(workers, users):
+    others = [username for _, username in users[1:]]
+    clients = [TestUser(port, user_id, username, contacts=others if i == 0 else ())
+               for i, ((port, _), (user_id, username)) in enumerate(zip(workers, users))]
+    failures = []
+
+    for client in clients:
+        if not client.authenticated.wait(5):
+            failures.append(f'{client.username} was not authenticated')
+
+    # Every user the first one watches must be announced to it
+    first = clients[0]
+    watched = set(others)
+    if not first.wait_until(lambda: watched <= first.joined):
+        failures.append(f'presence_update missing joins on worker 0: {sorted(watched - first.joined)}')
+    if any(client.joined for client in clients[1:]):
+        failures.append('presence_update reached users who watch nobody')
+
+    # Room membership and room signals span workers
+    room = f'room-{uuid.uuid4().hex[:8]}'
+    for client in clients:
+        client.client.emit('join', {'room': room})
+    everyone = {c.username for c in clients}
+    for client in clients:
+        if not client.wait_until(lambda: everyone <= client.room_members):
+            failures.append(f'{client.username} does not see every room member')
+    marker = uuid.uuid4().hex
+    first.client.emit('signal', {'type': 'offer', 'sdp': marker, 'room': room})
+    for receiver in clients[1:]:
+        if not receiver.wait_until(lambda: any(s.get('sdp') == marker for s in receiver.signals)):
+            failures.append(f'room signal {first.username} -> {receiver.username} not delivered')
+
+    # Targeted signal between every pair of users on different workers
+    for sender in clients:
+        for receiver in clients:
+            if sender is receiver:
+                continue
+            marker = uuid.uuid4().hex
+            sender.client.emit('signal', {'type': 'offer', 'sdp': marker, 'target': receiver.username})
+            delivered = receiver.wait_until(
+                lambda: any(s.get('sdp') == marker for s in receiver.signals))
+            status = 'ok' if delivered else 'MISSING'
+            print(f'{sender.username} -> {receiver.username}: {status}')
+            if not delivered:
+                failures.append(f'signal {sender.username} -> {receiver.username} not delivered')
+
+    # A new offer restarts the exchange on the callee's worker too
+    caller, callee = clients[0], clients[1]
+    markers = {}
+    for step, (sender, receiver, kind) in enumerate([(caller, callee, 'offer'), (callee, caller, 'answer'),
+                                                     (caller, callee, 'offer')]):
+        markers[step] = uuid.uuid4().hex
+        sender.client.emit('signal', {'type': kind, 'sdp': markers[step], 'target': receiver.username})
+        if not receiver.wait_until(lambda: any(s.get('sdp') == markers[step] for s in receiver.signals)):
+            failures.append(f'{kind} {sender.username} -> {receiver.username} not delivered')
+    candidate, answer = uuid.uuid4().hex, uuid.uuid4().hex
+    callee.client.emit('signal', {'type': 'candidate', 'candidate': candidate, 'target': caller.username})
+    if caller.wait_until(lambda: any(s.get('candidate') == candidate for s in caller.signals), timeout=1):
+        failures.append('candidate sent after a restart offer was relayed before the new answer')
+    callee.client.emit('signal', {'type': 'answer', 'sdp': answer, 'target': caller.username})
+    if not caller.wait_until(lambda: {answer, candidate} <= {s.get('sdp') or s.get('candidate')
+                                                           for s in caller.signals}):
+        failures.append('new answer or the candidate held for it not delivered')
+    else:
+        order = [s.get('sdp') or s.get('candidate') for s in caller.signals]
+        if order.index(answer) > order.index(candidate):
+            failures.append('candidate held for the new answer arrived before it')
+
+    for client in clients:
+        client.client.disconnect()
+    return failures
+
+
+def check_availability(workers, users):
+    """Register through the first worker and check availability on the others.
+
+    The new user is appended to users so that it is removed afterwards.
+    """
+    username = f'cluster-{uuid.uuid4().hex[:8]}-new'
+    email = f'{username}@example.com'
+    response = requests.post(f'http://127.0.0.1:{workers[0][0]}/api/register',
+                             json={'username': username, 'email': email, 'password': uuid.uuid4().hex})
+    if response.status_code != 200:
+        return [f'registration on worker 0 failed with {response.status_code}']
+    users.append((response.json()['user']['id'], username))
+
+    failures = []
+    for i, (port, _) in enumerate(workers[1:], 1):
+        for field, value in (('username', username), ('email', email)):
+            answer = requests.get(f'http://127.0.0.1:{port}/api/check-{field}', params={field: value}).json()
+            if answer['available']:
+                failures.append(f'worker {i} reports {field} {value} registered on worker 0 as available')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--redis-url', help='use this broker instead of a local stand-in')
+    args = parser.parse_args()
+
+    broker_url = args.redis_url or start_broker()
+    print(f'Broker: {broker_url}')
+    users = seed_users(args.workers)
+    workers = []
+    try:
+        workers = start_workers(args.workers, broker_url)
+        print(f'Workers on ports: {[port for port, _ in workers]}')
+        failures = run_check(workers, users) + check_availability(workers, users)
+    finally:
+        for _, process in workers:
+            process.terminate()
+            process.wait()
+        remove_users(users)
+
+    if failures:
+        print('\nFAILED')
+        for failure in failures:
+            print(f'  {failure}')
+        sys.exit(1)
+    print('\nAll signals delivered and registrations seen across workers')
+
+
+if __name__ == '__main__':
+    main()
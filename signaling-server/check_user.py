@@ -13,7 +13,7 @@ with app.app_context():
         print(f"User found: {user}")
         print(f"Username: {user.username}")
         print(f"Email: {user.email}")
-        print(f"Password hash: {user.password_hash}")
+        print(f"Password hash: {User.get_auth_fields_by_email(user.email)['password_hash']}")
         print(f"Is active: {user.is_active}")
     else:
         print("User 'testuser' not found")
@@ -7,12 +7,106 @@ load_dotenv()
 class Config:
     # Flask configuration
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'hard-to-guess-string'
+    SOCKET_TOKEN_MAX_AGE = int(os.environ.get('SOCKET_TOKEN_MAX_AGE') or 12 * 60 * 60)  # Seconds a socket token stays valid
+    SOCKET_TOKEN_MAX_LIFETIME = int(os.environ.get('SOCKET_TOKEN_MAX_LIFETIME') or 24 * 60 * 60)  # Seconds from login, however often refreshed
+    
+    # Password hashing, in a pool of worker threads
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256:260000'  # Or e.g. scrypt:32768:8:1
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 2)
+    PASSWORD_HASH_QUEUE_LIMIT = int(os.environ.get('PASSWORD_HASH_QUEUE_LIMIT') or 32)  # Hashes waiting before 503s
+    
+    # Server configuration
+    PORT = int(os.environ.get('PORT') or 5000)
+    DEBUG = (os.environ.get('FLASK_DEBUG') or '1') == '1'
+    
+    # Socket.IO async mode: 'eventlet', 'gevent' or 'threading'. Left unset it is
+    # 'threading', which needs no monkey patching; serve.py patches and defaults to eventlet.
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE') or 'threading'
+    # Let clients connecting with ?serializer=msgpack exchange MessagePack packets
+    SOCKETIO_MSGPACK = (os.environ.get('SOCKETIO_MSGPACK') or '1') == '1'
+    # Transports clients may connect with. 'websocket' alone skips the long-polling
+    # handshake and upgrade, and clients then have to connect with transports: ['websocket'].
+    SOCKETIO_TRANSPORTS = (os.environ.get('SOCKETIO_TRANSPORTS') or 'polling,websocket').split(',')
+    # Accept permessage-deflate from websocket clients that offer it (eventlet only).
+    # Each compressing connection holds about 270 KB of zlib state.
+    SOCKETIO_WEBSOCKET_COMPRESSION = (os.environ.get('SOCKETIO_WEBSOCKET_COMPRESSION') or '1') == '1'
     
     # MongoDB configuration
     MONGO_URI = os.environ.get('MONGO_URI') or 'mongodb://localhost:27017/p2pchat'
+    # Create missing indexes in the background on startup (the availability filter is
+    # warmed either way). Set to 0 when indexes are created with "flask create-indexes".
+    PREPARE_DATABASE_ON_STARTUP = (os.environ.get('PREPARE_DATABASE_ON_STARTUP') or '1') == '1'
     
     # Flask-Login configuration
     LOGIN_VIEW = 'auth.login'
     
     # CORS configuration
     CORS_ORIGINS = '*'
+    
+    # Multi-node configuration. When set, Socket.IO emits are relayed through
+    # this message queue (e.g. redis://localhost:6379/0) and presence is shared
+    # through the store, so several workers can serve the same users.
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    PRESENCE_STORE_URL = os.environ.get('PRESENCE_STORE_URL') or SOCKETIO_MESSAGE_QUEUE
+    # Seconds without a heartbeat before a worker's connections are purged from the store
+    PRESENCE_WORKER_TTL = float(os.environ.get('PRESENCE_WORKER_TTL') or 30)
+    
+    # Seconds over which joins and leaves are merged into one presence broadcast
+    PRESENCE_BROADCAST_INTERVAL = float(os.environ.get('PRESENCE_BROADCAST_INTERVAL') or 0.1)
+    # Most presence_update emits per broadcast, the rest wait for the next one
+    PRESENCE_MAX_EMITS_PER_TICK = int(os.environ.get('PRESENCE_MAX_EMITS_PER_TICK') or 200)
+    
+    # Limits on presence subscriptions and chat rooms per connection
+    MAX_WATCHED_USERS = int(os.environ.get('MAX_WATCHED_USERS') or 500)
+    MAX_ROOMS_PER_CONNECTION = int(os.environ.get('MAX_ROOMS_PER_CONNECTION') or 20)
+    MAX_ROOM_NAME_LENGTH = 64
+    
+    # Offer/answer tracking between peers
+    NEGOTIATION_TIMEOUT = float(os.environ.get('NEGOTIATION_TIMEOUT') or 30)  # Idle seconds before a pair is dropped
+    NEGOTIATION_MAX_HELD_CANDIDATES = 100  # Early ICE candidates held per direction
+    SDP_ENCODINGS = ['deflate-raw']  # Compacted SDP formats relayed as opaque bytes
+    
+    # Socket events allowed per connection: event -> (tokens per second, burst)
+    RATE_LIMITS = {
+        'authenticate': (1, 5),
+        'signal': (50, 200),
+        'signal_batch': (20, 50),
+        'get_users': (1, 5),
+        'watch': (5, 20),
+        'unwatch': (5, 20),
+        'join': (2, 10),
+        'leave': (2, 10),
+        'join_dashboard': (1, 5),
+    }
+    
+    # Profile picture uploads
+    AVATAR_DIR = 'static/uploads/avatars'
+    AVATAR_MAX_BYTES = int(os.environ.get('AVATAR_MAX_BYTES') or 5 * 1024 * 1024)
+    AVATAR_MAX_PIXELS = 25000000
+    AVATAR_SIZES = (64, 128, 256)  # Square thumbnail sizes in pixels
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE') == '1'  # Let a front-end proxy send the files
+    MAX_CONTENT_LENGTH = AVATAR_MAX_BYTES + 64 * 1024  # Reject oversized requests before parsing them
+    
+    # Admin profiling endpoints under /admin, disabled unless a token is set
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')  # Sent as the X-Admin-Token header
+    PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS') or 30)    # Longest sampling run
+    SLOW_EVENT_THRESHOLD = float(os.environ.get('SLOW_EVENT_THRESHOLD') or 0.1)  # Seconds before a socket event is logged
+    SLOW_EVENT_LOG_SIZE = int(os.environ.get('SLOW_EVENT_LOG_SIZE') or 200)     # Slow events kept in memory
+    TRACEMALLOC_FRAMES = int(os.environ.get('TRACEMALLOC_FRAMES') or 10)        # Stack depth recorded per allocation
+    
+    # Server log configuration
+    LOG_CAPACITY = int(os.environ.get('LOG_CAPACITY') or 1000)       # Entries kept in memory
+    LOG_PAGE_SIZE = int(os.environ.get('LOG_PAGE_SIZE') or 100)      # Entries rendered on the index page
+    LOG_FLUSH_INTERVAL = float(os.environ.get('LOG_FLUSH_INTERVAL') or 0.25)  # Seconds between dashboard batches
+    
+    # Chat session journal configuration
+    SESSION_JOURNAL_BATCH_SIZE = int(os.environ.get('SESSION_JOURNAL_BATCH_SIZE') or 500)          # Records per bulk write
+    SESSION_JOURNAL_FLUSH_INTERVAL = float(os.environ.get('SESSION_JOURNAL_FLUSH_INTERVAL') or 1.0)  # Seconds between flushes
+    
+    # User cache configuration
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 10000)  # Users kept in memory
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL') or 60)     # Seconds before a cached user is re-read
+    
+    # Username/email availability filter configuration (single worker only)
+    AVAILABILITY_FILTER_CAPACITY = int(os.environ.get('AVAILABILITY_FILTER_CAPACITY') or 1000000)   # Expected number of users
+    AVAILABILITY_FILTER_ERROR_RATE = float(os.environ.get('AVAILABILITY_FILTER_ERROR_RATE') or 0.01)  # False positive rate
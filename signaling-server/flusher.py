@@ -0,0 +1,45 @@
+import atexit
+import threading
+
+
+class PeriodicFlusher:
+    """Calls flush every interval seconds from a Socket.IO background task.
+
+    Owners buffer work under their own lock and hand it off in flush();
+    this only decides when that happens. The task is started on first use,
+    since nothing needs flushing before then, and stops with the
+    interpreter rather than holding shutdown open. With flush_at_exit the
+    last buffered work is flushed by an atexit hook instead. A failed
+    flush is reported and the loop carries on, so one error (e.g. Redis
+    being briefly unreachable) does not stop flushing for good.
+    """
+
+    def __init__(self, flush, interval, flush_at_exit=False):
+        self._lock = threading.Lock()
+        self._flush = flush
+        self._interval = interval
+        self._socketio = None
+        self._started = False
+        if flush_at_exit:
+            atexit.register(flush)
+
+    def init_app(self, socketio, interval=None):
+        self._socketio = socketio
+        if interval is not None:
+            self._interval = interval
+
+    def start(self):
+        """Start the background task unless it is running or there is no app yet"""
+        with self._lock:
+            if self._started or self._socketio is None:
+                return
+            self._started = True
+        self._socketio.start_background_task(self._loop)
+
+    def _loop(self):
+        while threading.main_thread().is_alive():
+            self._socketio.sleep(self._interval)
+            try:
+                self._flush()
+            except Exception as e:
+                print(f"Warning: {self._flush.__qualname__} failed, retrying next interval: {e!r}")
@@ -18,11 +18,9 @@ class RegistrationForm(FlaskForm):
     submit = SubmitField('Register')
 
     def validate_username(self, username):
-        user = User.get_by_username(username.data)
-        if user is not None:
+        if User.exists_by_username(username.data):
             raise ValidationError('Please use a different username.')
 
     def validate_email(self, email):
-        user = User.get_by_email(email.data)
-        if user is not None:
+        if User.exists_by_email(email.data):
             raise ValidationError('Please use a different email address.')
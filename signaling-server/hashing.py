@@ -0,0 +1,137 @@
+import hashlib
+import hmac
+import threading
+
+from werkzeug.security import check_password_hash, gen_salt, generate_password_hash
+
+
+class HashingBusy(Exception):
+    """Raised when too many password hashes are already waiting for a worker"""
+
+
+def _scrypt_hex(password, salt, n, r, p):
+    # The same parameters and encoding werkzeug uses for its "scrypt:n:r:p" hashes
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt.encode('utf-8'),
+                          n=n, r=r, p=p, maxmem=132 * n * r * p).hex()
+
+
+def generate_hash(password, method):
+    """Hash a password with method, e.g. "pbkdf2:sha256:260000" or "scrypt:32768:8:1" """
+    if method.startswith('scrypt'):
+        n, r, p = (int(value) for value in method.split(':')[1:4])
+        salt = gen_salt(16)
+        return f'{method}${salt}${_scrypt_hex(password, salt, n, r, p)}'
+    return generate_password_hash(password, method=method)
+
+
+def check_hash(password_hash, password):
+    """Check a password against a stored hash in any supported format"""
+    if not password_hash or password is None:
+        return False
+    if password_hash.startswith('scrypt:'):
+        try:
+            method, salt, expected = password_hash.split('$', 2)
+            n, r, p = (int(value) for value in method.split(':')[1:4])
+        except ValueError:
+            return False
+        return hmac.compare_digest(_scrypt_hex(password, salt, n, r, p), expected)
+    try:
+        return check_password_hash(password_hash, password)
+    except (TypeError, ValueError):
+        return False
+
+
+class PasswordHasher:
+    """Runs password hashing in a bounded pool of workers.
+
+    Hashing is deliberately slow, so doing it on the request thread stalls
+    every other request behind a burst of logins. Calls block until a
+    worker is done, but at most max_pending hashes may be queued or running
+    at once; beyond that HashingBusy is raised straight away so the request
+    can be turned away with a 503 instead of piling up.
+
+    Workers are native threads: hashlib's KDFs release the GIL, so they
+    hash in parallel without forking the serving process, which is unsafe
+    once eventlet or gevent has monkey patched it. start() picks the pool
+    the async mode can wait on without blocking its event loop. Until it
+    is called, e.g. in CLI commands, hashes run on the calling thread.
+
+    method sets the algorithm and cost of new hashes. Stored hashes made
+    with anything else are reported by needs_rehash() so they can be
+    upgraded the next time the password is seen.
+    """
+
+    def __init__(self, workers=2, max_pending=32, method='pbkdf2:sha256:260000'):
+        self._lock = threading.Lock()
+        self._call = None
+        self._stop = None
+        self._pending = 0
+        self._workers = workers
+        self._max_pending = max_pending
+        self.method = method
+
+    def init_app(self, app, async_mode=None):
+        self._workers = app.config.get('PASSWORD_HASH_WORKERS', self._workers)
+        self._max_pending = app.config.get('PASSWORD_HASH_QUEUE_LIMIT', self._max_pending)
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.start(async_mode)
+
+    def start(self, async_mode=None):
+        """Set up the workers for async_mode ('eventlet', 'gevent' or 'threading').
+
+        Called at startup, never from a request. No thread is started
+        until the first hash.
+        """
+        with self._lock:
+            if self._call is not None:
+                return
+            if async_mode == 'eventlet':
+                from eventlet import tpool
+                from eventlet.semaphore import BoundedSemaphore
+                # Green whether or not the process is monkey patched, so waiting yields to the hub
+                slots = BoundedSemaphore(self._workers)
+
+                def call(fn, *args):
+                    with slots:
+                        return tpool.execute(fn, *args)
+                self._call, self._stop = call, None
+            elif async_mode == 'gevent':
+                from gevent.threadpool import ThreadPool
+                pool = ThreadPool(self._workers)
+                self._call, self._stop = (lambda fn, *args: pool.apply(fn, args)), pool.kill
+            else:
+                from concurrent.futures import ThreadPoolExecutor
+                executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='password-hash')
+                self._call = lambda fn, *args: executor.submit(fn, *args).result()
+                self._stop = lambda: executor.shutdown(wait=True)
+
+    def hash(self, password):
+        """Return a new hash of password made with the configured method"""
+        return self._run(generate_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        """Check a password against a stored hash"""
+        return self._run(check_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if password_hash was made with other parameters than the configured method"""
+        return bool(password_hash) and password_hash.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        """Stop the workers; the server calls this when it stops"""
+        with self._lock:
+            stop, self._call, self._stop = self._stop, None, None
+        if stop is not None:
+            stop()
+
+    def _run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self._max_pending:
+                raise HashingBusy()
+            self._pending += 1
+            call = self._call
+        try:
+            return call(fn, *args) if call is not None else fn(*args)
+        finally:
+            with self._lock:
+                self._pending -= 1
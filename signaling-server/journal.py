@@ -0,0 +1,88 @@
+import threading
+from datetime import datetime
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from flusher import PeriodicFlusher
+from models import mongo, ChatSession
+
+
+class SessionJournal:
+    """Write-behind journal for chat session records.
+
+    Socket handlers record session opens and closes here instead of writing
+    to MongoDB themselves. Pending records are written with a single
+    bulk_write once max_batch of them are queued, every flush_interval
+    seconds, and at interpreter exit. A session that opens and closes
+    within the same batch is written as one closed insert.
+    """
+
+    def __init__(self, max_batch=500, flush_interval=1.0):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Keeps batches in order, a close must not overtake its open
+        self._pending = {}  # Map of session_id to ('open', document) or ('close', fields)
+        self._max_batch = max_batch
+        self._flusher = PeriodicFlusher(self.flush, flush_interval, flush_at_exit=True)
+
+    def init_app(self, app, socketio):
+        self._max_batch = app.config.get('SESSION_JOURNAL_BATCH_SIZE', self._max_batch)
+        self._flusher.init_app(socketio, app.config.get('SESSION_JOURNAL_FLUSH_INTERVAL'))
+
+    def open(self, session_id, user_id):
+        """Queue the insert of a new active session"""
+        document = ChatSession(session_id=session_id, user_id=user_id).to_document()
+        self._queue(session_id, ('open', document))
+
+    def close(self, session_id):
+        """Queue marking a session as disconnected"""
+        fields = {'disconnected_at': datetime.utcnow(), 'is_active': False}
+        self._queue(session_id, ('close', fields))
+
+    @staticmethod
+    def _merge(pending, session_id, record):
+        current = pending.get(session_id)
+        if record[0] == 'close' and current is not None and current[0] == 'open':
+            # Not written yet, so insert it already closed
+            current[1].update(record[1])
+        else:
+            pending[session_id] = record
+
+    def _queue(self, session_id, record):
+        with self._lock:
+            self._merge(self._pending, session_id, record)
+            full = len(self._pending) >= self._max_batch
+        self._flusher.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write all pending records in one bulk_write"""
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            batch = self._pending
+            self._pending = {}
+
+        requests = []
+        for session_id, (kind, data) in batch.items():
+            if kind == 'open':
+                requests.append(InsertOne(data))
+            else:
+                requests.append(UpdateOne({'session_id': session_id, 'is_active': True},
+                                          {'$set': data}))
+        try:
+            # Each session appears at most once per batch, so order does not matter
+            mongo.db.chat_sessions.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            print(f"Warning: {len(e.details.get('writeErrors', []))} session records failed to write")
+        except PyMongoError as e:
+            print(f"Warning: session journal flush failed, retrying later: {e}")
+            with self._lock:
+                newer, self._pending = self._pending, batch
+                for session_id, record in newer.items():
+                    self._merge(self._pending, session_id, record)
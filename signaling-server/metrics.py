@@ -0,0 +1,199 @@
+import bisect
+import threading
+import time
+from functools import wraps
+
+from flask import g, request
+from pymongo import monitoring
+
+# Upper bounds in seconds, from sub-millisecond socket events to slow Mongo writes
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, size):
+        self.counts = [0] * (size + 1)  # One per bucket plus +Inf, not cumulative
+        self.sum = 0.0
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Times every command pymongo sends, by command name"""
+
+    def __init__(self, metrics):
+        self._metrics = metrics
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._metrics.observe('mongo_command_duration_seconds', (('command', event.command_name),),
+                              event.duration_micros / 1e6)
+
+    def failed(self, event):
+        labels = (('command', event.command_name),)
+        self._metrics.observe('mongo_command_duration_seconds', labels, event.duration_micros / 1e6)
+        self._metrics.inc('mongo_command_errors_total', labels)
+
+
+class Metrics:
+    """Counters, latency histograms and gauges, served in Prometheus text format.
+
+    Recording is a perf_counter pair, a bisect and a couple of dict updates
+    under a lock, so it stays in the low microseconds per event. Gauges and
+    counters owned by other components are not copied in; they are read
+    from collector callbacks when /metrics is scraped.
+
+    Socket handlers are timed with the event() decorator, HTTP requests by
+    hooks installed in init_app, and Mongo commands by mongo_listener,
+    which has to be passed to the MongoClient.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self._lock = threading.Lock()
+        self._buckets = tuple(buckets)
+        self._counters = {}    # Map of (name, labels) to value
+        self._histograms = {}  # Map of (name, labels) to _Histogram
+        self._collectors = []  # (name, fn) pairs read at scrape time
+        self._help = {
+            'socketio_event_errors_total': ('counter', 'Socket.IO event handlers that raised'),
+            'socketio_event_duration_seconds': ('histogram', 'Time spent handling a Socket.IO event'),
+            'http_requests_total': ('counter', 'HTTP requests by endpoint and status'),
+            'http_request_duration_seconds': ('histogram', 'Time spent handling an HTTP request'),
+            'mongo_command_duration_seconds': ('histogram', 'MongoDB command round trip time'),
+            'mongo_command_errors_total': ('counter', 'MongoDB commands that failed'),
+        }
+        self.mongo_listener = MongoCommandTimer(self)
+
+    def init_app(self, app):
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    def gauge(self, name, text, fn):
+        """Register a gauge read from fn when scraped.
+
+        fn returns a value, or a dict of label tuples to values.
+        """
+        self._help[name] = ('gauge', text)
+        self._collectors.append((name, fn))
+
+    def counter(self, name, text, fn):
+        """Register a counter kept by another component, read like a gauge"""
+        self._help[name] = ('counter', text)
+        self._collectors.append((name, fn))
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        key = (name, labels)
+        index = bisect.bisect_left(self._buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(len(self._buckets))
+            histogram.counts[index] += 1
+            histogram.sum += seconds
+
+    def event(self, event):
+        """Decorator counting and timing a Socket.IO event handler"""
+        labels = (('event', event),)
+
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                except Exception:
+                    self.inc('socketio_event_errors_total', labels)
+                    raise
+                finally:
+                    self.observe('socketio_event_duration_seconds', labels,
+                                 time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def _start_request(self):
+        g.metrics_started = time.perf_counter()
+
+    def _finish_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            # The endpoint rather than the path, so URLs with ids don't each get a series
+            endpoint = request.endpoint or 'unmatched'
+            self.observe('http_request_duration_seconds', (('endpoint', endpoint),),
+                         time.perf_counter() - started)
+            self.inc('http_requests_total', (('endpoint', endpoint), ('method', request.method),
+                                             ('status', str(response.status_code))))
+        return response
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = [(key, list(h.counts), h.sum) for key, h in self._histograms.items()]
+        samples = {}
+        for (name, labels), value in counters:
+            samples.setdefault(name, []).append((name, labels, value))
+        for (name, labels), counts, total in histograms:
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self._buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append((name + '_bucket', labels + (('le', le),), cumulative))
+            lines.append((name + '_sum', labels, total))
+            lines.append((name + '_count', labels, cumulative))
+        for name, fn in self._collectors:
+            samples.setdefault(name, []).extend(_collect(name, fn()))
+
+        out = []
+        for name in sorted(samples):
+            if name in self._help:
+                kind, text = self._help[name]
+                out.append(f'# HELP {name} {text}')
+                out.append(f'# TYPE {name} {kind}')
+            for sample_name, labels, value in samples[name]:
+                out.append(f'{sample_name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(out) + '\n'
+
+    def view(self):
+        return self.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def _collect(name, value):
+    # A collector returns a single value, or a map of label tuples to values
+    if isinstance(value, dict):
+        return [(name, labels, v) for labels, v in value.items()]
+    return [(name, (), value)]
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+metrics = Metrics()
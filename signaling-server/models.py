@@ -1,18 +1,31 @@
+import sys
 from flask_pymongo import PyMongo
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 from bson.objectid import ObjectId
+from cache import UserCache
+from availability import AvailabilityFilter
+from hashing import PasswordHasher
 
 # Initialize PyMongo
 mongo = PyMongo()
 
+# Recently used user documents, keyed by id, username and email
+user_cache = UserCache()
+
+# Bloom filters of taken usernames and emails, for availability checks
+availability = AvailabilityFilter()
+
+# Password hashing, off the request thread in a bounded worker pool
+password_hasher = PasswordHasher()
+
 class User(UserMixin):
     """User model for MongoDB"""
     
     def __init__(self, username=None, email=None, password=None, _id=None, 
                  created_at=None, last_login=None, is_active=True, password_hash=None,
-                 profile_picture=None, display_name=None, bio=None, status=None, **kwargs):
+                 profile_picture=None, display_name=None, bio=None, status=None, avatar=None,
+                 **kwargs):
         self._id = _id
         self.username = username
         self.email = email
@@ -25,6 +38,7 @@ class User(UserMixin):
         
         # Profile fields
         self.profile_picture = profile_picture or ""  # URL to profile picture
+        self.avatar = avatar  # Content hash of the uploaded profile picture
         self.display_name = display_name or username  # Display name (defaults to username)
         self.bio = bio or ""  # User bio/about
         self.status = status or "Available"  # User status
@@ -40,53 +54,105 @@ class User(UserMixin):
         self._is_active = value
         
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
         
     def check_password(self, password):
-        try:
-            return check_password_hash(self.password_hash, password)
-        except ValueError as e:
-            # Handle the case where the hash algorithm is not supported
-            if "unsupported hash type" in str(e) and self.password_hash.startswith("scrypt:"):
-                # For demonstration purposes, we'll use a simple fallback
-                # In a real application, you might want to rehash the password with a supported algorithm
-                print(f"Warning: Unsupported hash type. Using fallback authentication method.")
-                
-                # For testing purposes, allow login with any password
-                # This is NOT secure and should be replaced with proper handling in production
-                return True
-            else:
-                # Re-raise other errors
-                raise
+        # Users loaded through the cache carry no hash, so read it afresh
+        password_hash = self.password_hash
+        if password_hash is None and self._id is not None:
+            user_data = mongo.db.users.find_one({"_id": self._id}, {"password_hash": 1})
+            password_hash = user_data.get("password_hash") if user_data else None
+        return self.verify_password(password_hash, password)
+    
+    @staticmethod
+    def verify_password(password_hash, password):
+        """Check a password against a stored hash without loading a User"""
+        return password_hasher.verify(password_hash, password)
+    
+    def upgrade_password_hash(self, password, password_hash):
+        """Rehash a just-verified password if password_hash, its stored hash, uses outdated parameters.
+
+        Returns True if the hash changed and the user needs saving.
+        """
+        if not password_hasher.needs_rehash(password_hash):
+            return False
+        self.set_password(password)
+        return True
     
     def get_id(self):
         return str(self._id)
     
+    @classmethod
+    def _get_cached(cls, field, value, query):
+        """Get user from the cache, falling back to the database.
+
+        Password hashes are never cached; see get_auth_fields_by_email().
+        """
+        user_data = user_cache.get(field, value)
+        if user_data is None:
+            user_data = mongo.db.users.find_one(query, {"password_hash": 0})
+            if user_data is None:
+                return None
+            user_cache.put(user_data)
+        return cls(**user_data)
+    
     @classmethod
     def get_by_id(cls, user_id):
         """Get user by ID"""
         if not ObjectId.is_valid(user_id):
             return None
-        user_data = mongo.db.users.find_one({"_id": ObjectId(user_id)})
-        if user_data:
-            return cls(**user_data)
-        return None
+        return cls._get_cached("_id", user_id, {"_id": ObjectId(user_id)})
     
     @classmethod
     def get_by_username(cls, username):
         """Get user by username"""
-        user_data = mongo.db.users.find_one({"username": username})
-        if user_data:
-            return cls(**user_data)
-        return None
+        return cls._get_cached("username", username, {"username": username})
     
     @classmethod
     def get_by_email(cls, email):
         """Get user by email"""
-        user_data = mongo.db.users.find_one({"email": email})
-        if user_data:
-            return cls(**user_data)
-        return None
+        return cls._get_cached("email", email, {"email": email})
+    
+    @staticmethod
+    def exists_by_username(username):
+        """Check whether a username is taken, using only the username index"""
+        return mongo.db.users.count_documents({"username": username}, limit=1) > 0
+    
+    @staticmethod
+    def exists_by_email(email):
+        """Check whether an email is registered, using only the email index"""
+        return mongo.db.users.count_documents({"email": email}, limit=1) > 0
+    
+    @classmethod
+    def is_username_available(cls, username):
+        """Availability check that only queries MongoDB on a filter hit"""
+        if not availability.might_be_taken("username", username):
+            return True
+        return not cls.exists_by_username(username)
+    
+    @classmethod
+    def is_email_available(cls, email):
+        """Availability check that only queries MongoDB on a filter hit"""
+        if not availability.might_be_taken("email", email):
+            return True
+        return not cls.exists_by_email(email)
+    
+    @staticmethod
+    def avatar_in_use(content_hash):
+        """Check whether any user's profile picture has this content hash"""
+        return mongo.db.users.count_documents({"avatar": content_hash}, limit=1) > 0
+    
+    @staticmethod
+    def get_auth_fields_by_email(email):
+        """Get just the _id and password_hash needed to check a login.
+
+        Always read from the database, so a password change on any worker
+        takes effect at once.
+        """
+        user_data = mongo.db.users.find_one({"email": email}, {"password_hash": 1})
+        if user_data is None:
+            return None
+        return {"_id": user_data["_id"], "password_hash": user_data.get("password_hash")}
     
     def save(self):
         """Save user to database"""
@@ -98,6 +164,7 @@ class User(UserMixin):
             "last_login": self.last_login,
             "is_active": self._is_active,
             "profile_picture": self.profile_picture,
+            "avatar": self.avatar,
             "display_name": self.display_name,
             "bio": self.bio,
             "status": self.status
@@ -107,16 +174,22 @@ class User(UserMixin):
         print(f"Saving user with password_hash: {self.password_hash}")
         
         if self._id:
-            # Update existing user
+            # Update existing user, keeping the stored hash unless it was changed
+            if self.password_hash is None:
+                del user_data["password_hash"]
             mongo.db.users.update_one(
                 {"_id": self._id},
                 {"$set": user_data}
             )
+            user_cache.invalidate(self._id)
         else:
             # Insert new user
             result = mongo.db.users.insert_one(user_data)
             self._id = result.inserted_id
         
+        availability.add("username", self.username)
+        availability.add("email", self.email)
+        
         return self
     
     def __repr__(self):
@@ -126,11 +199,14 @@ class User(UserMixin):
 class ChatSession:
     """Chat session model for MongoDB"""
     
+    # One is made per socket connection, so skip the per-instance __dict__
+    __slots__ = ('_id', 'session_id', 'user_id', 'connected_at', 'disconnected_at', 'is_active')
+    
     def __init__(self, session_id=None, user_id=None, connected_at=None, 
                  disconnected_at=None, is_active=True, _id=None, **kwargs):
         self._id = _id
         self.session_id = session_id
-        self.user_id = user_id
+        self.user_id = sys.intern(user_id) if isinstance(user_id, str) else user_id
         self.connected_at = connected_at or datetime.utcnow()
         self.disconnected_at = disconnected_at
         self.is_active = is_active
@@ -151,15 +227,19 @@ class ChatSession:
             sessions.append(cls(**session_data))
         return sessions
     
-    def save(self):
-        """Save chat session to database"""
-        session_data = {
+    def to_document(self):
+        """Return the MongoDB document for this session"""
+        return {
             "session_id": self.session_id,
             "user_id": self.user_id,
             "connected_at": self.connected_at,
             "disconnected_at": self.disconnected_at,
             "is_active": self.is_active
         }
+    
+    def save(self):
+        """Save chat session to database"""
+        session_data = self.to_document()
         
         if self._id:
             # Update existing session
@@ -178,14 +258,39 @@ class ChatSession:
         return f'<ChatSession {self.session_id}>'
 
 
-# Create indexes for MongoDB collections
+def warm_availability_filter():
+    """Load every existing username and email into the availability filter"""
+    if not availability.enabled:
+        return
+    availability.warm(mongo.db.users.find({}, {"_id": 0, "username": 1, "email": 1}))
+
+
+# Indexes per collection: (keys, options)
+INDEXES = {
+    "users": [
+        ([("username", 1)], {"unique": True}),
+        ([("email", 1)], {"unique": True}),
+        ([("avatar", 1)], {"sparse": True}),
+    ],
+    "chat_sessions": [
+        ([("session_id", 1)], {"unique": True}),
+        ([("user_id", 1)], {}),
+        ([("user_id", 1), ("is_active", 1)], {}),
+    ],
+}
+
+
 def create_indexes():
-    """Create indexes for MongoDB collections"""
-    # User indexes
-    mongo.db.users.create_index("username", unique=True)
-    mongo.db.users.create_index("email", unique=True)
-    
-    # Chat session indexes
-    mongo.db.chat_sessions.create_index("session_id", unique=True)
-    mongo.db.chat_sessions.create_index("user_id")
-    mongo.db.chat_sessions.create_index([("user_id", 1), ("is_active", 1)])
+    """Create the MongoDB indexes that do not exist yet, returning their names.
+
+    Existing indexes are looked up first, so running this on every start
+    costs one listIndexes per collection rather than a createIndexes each.
+    """
+    created = []
+    for collection_name, indexes in INDEXES.items():
+        collection = mongo.db[collection_name]
+        existing = {tuple(info["key"]) for info in collection.index_information().values()}
+        for keys, options in indexes:
+            if tuple(keys) not in existing:
+                created.append(f'{collection_name}.{collection.create_index(keys, **options)}')
+    return created
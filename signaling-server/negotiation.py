@@ -0,0 +1,148 @@
+import threading
+import time
+import uuid
+
+DESCRIPTION_TYPES = ('offer', 'answer')
+
+
+class _Leg:
+    """One direction of a negotiation: what sender has relayed to target"""
+
+    __slots__ = ('described', 'held', 'updated_at', 'peer_offer')
+
+    def __init__(self, peer_offer=None):
+        self.described = False  # An offer or answer has been relayed
+        self.held = []          # Candidates waiting for that description
+        self.updated_at = time.monotonic()
+        self.peer_offer = peer_offer  # Token of target's latest offer, when shared
+
+
+class RedisOfferLog:
+    """The latest offer between each pair of users, shared by several workers.
+
+    Every relayed offer is stored under a fresh token in
+    <prefix><sender>:<target>, expiring after ttl seconds. A worker that
+    sees the token change for an offer made to one of its users knows the
+    exchange restarted, even if the offer was relayed by another worker.
+    """
+
+    def __init__(self, url, ttl, prefix='p2pchat:offers:'):
+        import redis
+
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._ttl_ms = max(int(ttl * 1000), 1)
+        self._prefix = prefix
+
+    def record(self, sender, target):
+        """Store a new offer from sender to target and return its token"""
+        token = uuid.uuid4().hex
+        self._redis.set(f'{self._prefix}{sender}:{target}', token, px=self._ttl_ms)
+        return token
+
+    def latest(self, sender, target):
+        """Return the token of sender's latest offer to target, or None"""
+        return self._redis.get(f'{self._prefix}{sender}:{target}')
+
+
+class NegotiationTracker:
+    """Offer/answer state for every pair of users currently negotiating.
+
+    ICE candidates are only useful to a peer that already has the sender's
+    session description, so candidates sent ahead of the offer (or, from
+    the callee, ahead of the answer) are held here and released right after
+    it. A new offer restarts the exchange for both directions. Pairs idle
+    for longer than the timeout are dropped along with anything they hold,
+    and a user going offline drops every pair they are part of.
+
+    Each direction is tracked on the worker holding the sender's socket,
+    where all of their signals arrive. When the peer's direction lives on
+    another worker, the offer only reaches it through the shared offer
+    log (PRESENCE_STORE_URL): every call for that direction checks the
+    log, and a changed token resets the direction before the signals are
+    handled. Without a shared store, a single worker holds both directions.
+    """
+
+    def __init__(self, timeout=30, max_held=100):
+        self._lock = threading.Lock()
+        self._legs = {}          # Map of (sender, target) to _Leg
+        self._keys_by_user = {}  # Map of username to the (sender, target) keys it appears in
+        self._timeout = timeout
+        self._max_held = max_held
+        self._next_sweep = time.monotonic() + timeout
+        self._offers = None  # RedisOfferLog when several workers share the negotiations
+
+    def init_app(self, app):
+        self._timeout = app.config.get('NEGOTIATION_TIMEOUT', self._timeout)
+        self._max_held = app.config.get('NEGOTIATION_MAX_HELD_CANDIDATES', self._max_held)
+        if app.config.get('PRESENCE_STORE_URL'):
+            self._offers = RedisOfferLog(app.config['PRESENCE_STORE_URL'], self._timeout)
+
+    def outgoing(self, sender, target, signals):
+        """Return the signals from sender that should reach target now, in order"""
+        # Offers are shared before the lock is taken, so Redis is never waited on while holding it
+        peer_offer = offer = None
+        if self._offers is not None:
+            peer_offer = self._offers.latest(target, sender)
+            if any(signal.get('type') == 'offer' for signal in signals):
+                offer = self._offers.record(sender, target)
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            leg = self._legs.get((sender, target))
+            if leg is None:
+                leg = self._legs[(sender, target)] = _Leg(peer_offer)
+                self._keys_by_user.setdefault(sender, set()).add((sender, target))
+                self._keys_by_user.setdefault(target, set()).add((sender, target))
+            elif peer_offer is not None and peer_offer != leg.peer_offer:
+                # Target made a new offer through another worker
+                leg.described = False
+                leg.held = []
+                leg.peer_offer = peer_offer
+            leg.updated_at = now
+            for signal in signals:
+                kind = signal.get('type')
+                if kind in DESCRIPTION_TYPES:
+                    if kind == 'offer':
+                        # The target has to answer this offer before its candidates are useful
+                        reverse = self._legs.get((target, sender))
+                        if reverse is not None:
+                            reverse.described = False
+                            reverse.held = []
+                            reverse.peer_offer = offer
+                    leg.described = True
+                    ready.append(signal)
+                    ready.extend(leg.held)
+                    leg.held = []
+                elif kind == 'candidate' and not leg.described:
+                    if len(leg.held) < self._max_held:
+                        leg.held.append(signal)
+                else:
+                    ready.append(signal)
+        return ready
+
+    def forget(self, username):
+        """Drop every pair involving a user who went offline"""
+        with self._lock:
+            for key in list(self._keys_by_user.get(username, ())):
+                self._drop(key)
+
+    def _sweep(self, now):
+        expired = now - self._timeout
+        for key in [key for key, leg in self._legs.items() if leg.updated_at < expired]:
+            self._drop(key)
+        self._next_sweep = now + self._timeout
+
+    def _drop(self, key):
+        del self._legs[key]
+        for username in key:
+            keys = self._keys_by_user.get(username)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_user[username]
+
+    def __len__(self):
+        """Number of directions currently tracked"""
+        return len(self._legs)
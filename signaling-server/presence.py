@@ -0,0 +1,489 @@
+import atexit
+import sys
+import threading
+import time
+import uuid
+
+from flusher import PeriodicFlusher
+
+
+def presence_room(username):
+    """Socket.IO room of the clients watching username's presence"""
+    return f'presence:{username}'
+
+
+def chat_room(room):
+    """Socket.IO room of the members of a named chat room"""
+    return f'room:{room}'
+
+
+class Connection:
+    """An authenticated socket connection.
+
+    Slotted to skip a per-instance __dict__, with the user id and username
+    interned so every index referring to a user shares one copy of each
+    string however many connections and rooms they have.
+    """
+
+    __slots__ = ('user_id', 'username', 'rooms')
+
+    def __init__(self, user_id, username):
+        self.user_id = sys.intern(user_id)
+        self.username = sys.intern(username)
+        self.rooms = ()  # Chat rooms joined, there are only ever a few
+
+    def __repr__(self):
+        return f'<Connection {self.username}>'
+
+
+class PresenceRegistry:
+    """In-memory index of authenticated socket connections.
+
+    Keeps three maps in sync so that every lookup the signaling handlers
+    need is a single dict access:
+
+    - sid -> Connection
+    - user_id -> tuple of sids (oldest first, a user may have several tabs open)
+    - username -> user_id
+
+    Every time a user comes online or goes offline a shared version goes up
+    by one and the change is stamped with it. Clients only see the changes
+    of the users they watch, so they keep the last version per username and
+    ignore anything older.
+
+    Membership of named chat rooms is tracked per connection as well.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_sid = {}
+        self._sids_by_user = {}
+        self._user_by_name = {}
+        self._version = 0
+        self._rooms = {}  # Map of room to {sid: username}
+
+    def init_app(self, app, socketio, on_left=None):
+        """Nothing to set up: a single worker's connections go away with it"""
+
+    def add(self, sid, user_id, username):
+        """Register an authenticated connection.
+
+        Returns the new presence version if the user just came online,
+        None if they were already online from another connection or this
+        sid re-authenticated as the same user.
+        """
+        connection = Connection(user_id, username)
+        with self._lock:
+            previous = self._by_sid.get(sid)
+            if previous is not None:
+                if (previous.user_id, previous.username) == (connection.user_id, connection.username):
+                    # e.g. a refreshed token, the connection and its rooms stay as they are
+                    return None
+                for room in previous.rooms:
+                    self._leave_room(sid, previous, room)
+                self._discard(sid, previous)
+            self._by_sid[sid] = connection
+            self._sids_by_user[connection.user_id] = self._sids_by_user.get(connection.user_id, ()) + (sid,)
+            if self._user_by_name.get(connection.username) == connection.user_id:
+                return None
+            self._user_by_name[connection.username] = connection.user_id
+            self._version += 1
+            return self._version
+
+    def remove(self, sid):
+        """Forget a connection.
+
+        Returns (user_id, username, version) where version is the new
+        presence version if that was the user's last connection and None
+        otherwise, or None if the sid was not authenticated.
+        """
+        with self._lock:
+            connection = self._by_sid.pop(sid, None)
+            if connection is None:
+                return None
+            for room in connection.rooms:
+                self._leave_room(sid, connection, room)
+            if not self._discard(sid, connection):
+                return connection.user_id, connection.username, None
+            self._version += 1
+            return connection.user_id, connection.username, self._version
+
+    def _discard(self, sid, connection):
+        """Drop sid from the indexes, returning True if the user went offline"""
+        sids = self._sids_by_user.get(connection.user_id)
+        if sids is None:
+            return False
+        sids = tuple(s for s in sids if s != sid)
+        if sids:
+            self._sids_by_user[connection.user_id] = sids
+            return False
+        del self._sids_by_user[connection.user_id]
+        if self._user_by_name.get(connection.username) == connection.user_id:
+            del self._user_by_name[connection.username]
+            return True
+        return False
+
+    def get(self, sid):
+        """Return the Connection of an authenticated sid, or None"""
+        return self._by_sid.get(sid)
+
+    def sid_for_username(self, username):
+        """Return the sid a targeted signal for username should go to"""
+        with self._lock:
+            user_id = self._user_by_name.get(username)
+            if user_id is None:
+                return None
+            return next(iter(self._sids_by_user.get(user_id, ())), None)
+
+    def snapshot(self, usernames=None):
+        """Return (version, online) where online lists which of usernames
+        (all users when None) are online as of version"""
+        with self._lock:
+            if usernames is None:
+                return self._version, list(self._user_by_name)
+            return self._version, [u for u in usernames if u in self._user_by_name]
+
+    def join_room(self, sid, room):
+        """Add an authenticated sid to a chat room, returning True if it was not a member"""
+        with self._lock:
+            connection = self._by_sid.get(sid)
+            if connection is None or room in connection.rooms:
+                return False
+            self._rooms.setdefault(room, {})[sid] = connection.username
+            connection.rooms += (room,)
+            return True
+
+    def leave_room(self, sid, room):
+        """Remove a sid from a chat room, returning True if it was a member"""
+        with self._lock:
+            connection = self._by_sid.get(sid)
+            return connection is not None and self._leave_room(sid, connection, room)
+
+    def _leave_room(self, sid, connection, room):
+        if room not in connection.rooms:
+            return False
+        connection.rooms = tuple(r for r in connection.rooms if r != room)
+        members = self._rooms[room]
+        del members[sid]
+        if not members:
+            del self._rooms[room]
+        return True
+
+    def rooms_of(self, sid):
+        """Return the chat rooms a sid has joined"""
+        connection = self._by_sid.get(sid)
+        return list(connection.rooms) if connection is not None else []
+
+    def room_members(self, room):
+        """Return the usernames in a chat room, once each"""
+        with self._lock:
+            return list(dict.fromkeys(self._rooms.get(room, {}).values()))
+
+    def room_count(self):
+        """Number of chat rooms with members"""
+        return len(self._rooms)
+
+    def __contains__(self, sid):
+        return sid in self._by_sid
+
+    def __len__(self):
+        """Number of authenticated connections"""
+        return len(self._by_sid)
+
+
+# Adds a sid, owned by the worker whose sids hash is KEYS[5], and if the user
+# was not online yet bumps the presence version.
+# Returns the new version, or 0 if the user was already online.
+_ADD_SCRIPT = """
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[4])
+redis.call('HSET', KEYS[5], ARGV[1], ARGV[4])
+redis.call('ZADD', KEYS[2], ARGV[5], ARGV[1])
+if redis.call('HGET', KEYS[3], ARGV[2]) == ARGV[3] then
+    return 0
+end
+redis.call('HSET', KEYS[3], ARGV[2], ARGV[3])
+return redis.call('INCR', KEYS[4])
+"""
+
+# Removes a sid and, if it was the user's last connection, the username
+# mapping, atomically so a concurrent connect on another worker is not lost.
+# Returns the new presence version, or 0 if the user is still online.
+_REMOVE_SCRIPT = """
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[5], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+if redis.call('ZCARD', KEYS[2]) == 0 and redis.call('HGET', KEYS[3], ARGV[2]) == ARGV[3] then
+    redis.call('HDEL', KEYS[3], ARGV[2])
+    return redis.call('INCR', KEYS[4])
+end
+return 0
+"""
+
+
+class RedisPresenceRegistry:
+    """Presence registry shared by several workers through Redis.
+
+    Connections owned by this worker are also kept in a local
+    PresenceRegistry, so authenticating the sender of an event never leaves
+    the process. Only lookups that can involve other workers (the target of
+    a signal, the online user list, the connection count) go to Redis:
+
+    - <prefix>connections: hash of sid -> "user_id username"
+    - <prefix>users: hash of username -> user_id
+    - <prefix>sids:<username>: sorted set of sids, scored by connect time
+    - <prefix>version: the shared presence version
+    - <prefix>room:<room>: hash of sid -> username for each chat room
+    - <prefix>workers: set of worker ids
+    - <prefix>worker:<id>: heartbeat, expiring worker_ttl seconds after the last one
+    - <prefix>worker:<id>:sids: hash of sid -> "user_id username" owned by the worker
+    - <prefix>worker:<id>:rooms: set of chat rooms the worker's sids have joined
+
+    A worker that crashes leaves its sids behind. Each worker refreshes its
+    heartbeat a few times per worker_ttl and purges the workers whose
+    heartbeat expired, taking their users offline unless they reconnected
+    elsewhere. It purges on startup too and removes its own sids at exit.
+    """
+
+    def __init__(self, url, prefix='p2pchat:presence:', worker_ttl=30):
+        import redis
+
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._local = PresenceRegistry()
+        self._prefix = prefix
+        self._connections_key = prefix + 'connections'
+        self._users_key = prefix + 'users'
+        self._version_key = prefix + 'version'
+        self._workers_key = prefix + 'workers'
+        self._add_script = self._redis.register_script(_ADD_SCRIPT)
+        self._remove_script = self._redis.register_script(_REMOVE_SCRIPT)
+        self.worker_id = uuid.uuid4().hex
+        self._worker_ttl = worker_ttl
+        self._on_left = None
+        self._heartbeat = None
+
+    def init_app(self, app, socketio, on_left=None):
+        """Register this worker, purge dead ones and keep the heartbeat going.
+
+        on_left(username, version) is called for every user a purge took offline.
+        """
+        self._worker_ttl = app.config.get('PRESENCE_WORKER_TTL', self._worker_ttl)
+        self._on_left = on_left
+        self._redis.set(self._worker_key(self.worker_id), 1, px=int(self._worker_ttl * 1000))
+        self._redis.sadd(self._workers_key, self.worker_id)
+        self.purge_dead_workers()
+        self._heartbeat = PeriodicFlusher(self.heartbeat, self._worker_ttl / 3)
+        self._heartbeat.init_app(socketio)
+        self._heartbeat.start()
+        atexit.register(self.shutdown)
+
+    def _worker_key(self, worker_id):
+        return f'{self._prefix}worker:{worker_id}'
+
+    def _sids_key(self, username):
+        return f'{self._prefix}sids:{username}'
+
+    def _keys(self, username, worker_id=None):
+        return [self._connections_key, self._sids_key(username), self._users_key, self._version_key,
+                self._worker_key(worker_id or self.worker_id) + ':sids']
+
+    def heartbeat(self):
+        """Tell the other workers this one is alive, and purge those that are not"""
+        self._redis.set(self._worker_key(self.worker_id), 1, px=int(self._worker_ttl * 1000))
+        self.purge_dead_workers()
+
+    def purge_dead_workers(self):
+        """Remove the sids of every worker whose heartbeat expired"""
+        for worker_id in self._redis.smembers(self._workers_key):
+            if worker_id != self.worker_id and not self._redis.exists(self._worker_key(worker_id)):
+                self._purge(worker_id)
+
+    def shutdown(self):
+        """Remove this worker's sids before it stops"""
+        self._purge(self.worker_id)
+
+    def _purge(self, worker_id):
+        sids_key = self._worker_key(worker_id) + ':sids'
+        rooms_key = self._worker_key(worker_id) + ':rooms'
+        entries = self._redis.hgetall(sids_key)
+        if entries:
+            for room in self._redis.smembers(rooms_key):
+                self._redis.hdel(self._room_key(room), *entries)
+        for sid, value in entries.items():
+            user_id, username = value.split(' ', 1)
+            version = int(self._remove_script(keys=self._keys(username, worker_id),
+                                              args=[sid, username, user_id]))
+            if version and self._on_left is not None:
+                self._on_left(username, version)
+        self._redis.delete(sids_key, rooms_key, self._worker_key(worker_id))
+        self._redis.srem(self._workers_key, worker_id)
+
+    def add(self, sid, user_id, username):
+        """Register an authenticated connection, see PresenceRegistry.add"""
+        previous = self._local.get(sid)
+        if previous is not None:
+            if (previous.user_id, previous.username) == (user_id, username):
+                return None
+            self.remove(sid)
+        self._local.add(sid, user_id, username)
+        version = self._add_script(keys=self._keys(username),
+                                   args=[sid, username, user_id, f'{user_id} {username}', time.time()])
+        return int(version) or None
+
+    def remove(self, sid):
+        """Forget a connection, see PresenceRegistry.remove"""
+        for room in self._local.rooms_of(sid):
+            self.leave_room(sid, room)
+        entry = self._local.remove(sid)
+        if entry is None:
+            return None
+        user_id, username, _ = entry
+        version = self._remove_script(keys=self._keys(username), args=[sid, username, user_id])
+        return user_id, username, int(version) or None
+
+    def get(self, sid):
+        """Return the Connection of a sid connected to this worker"""
+        return self._local.get(sid)
+
+    def sid_for_username(self, username):
+        """Return the sid a targeted signal for username should go to, the newest one"""
+        sids = self._redis.zrange(self._sids_key(username), -1, -1)
+        return sids[0] if sids else None
+
+    def _room_key(self, room):
+        return f'{self._prefix}room:{room}'
+
+    def snapshot(self, usernames=None):
+        """Return (version, online) across every worker, see PresenceRegistry.snapshot"""
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.get(self._version_key)
+        if usernames is None:
+            pipe.hkeys(self._users_key)
+            version, online = pipe.execute()
+            return int(version or 0), online
+        if not usernames:
+            return int(pipe.execute()[0] or 0), []
+        pipe.hmget(self._users_key, usernames)
+        version, user_ids = pipe.execute()
+        return int(version or 0), [u for u, user_id in zip(usernames, user_ids) if user_id]
+
+    def join_room(self, sid, room):
+        """Add a sid to a chat room, see PresenceRegistry.join_room"""
+        connection = self._local.get(sid)
+        if connection is None or not self._local.join_room(sid, room):
+            return False
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.hset(self._room_key(room), sid, connection.username)
+        pipe.sadd(self._worker_key(self.worker_id) + ':rooms', room)
+        pipe.execute()
+        return True
+
+    def leave_room(self, sid, room):
+        """Remove a sid from a chat room, see PresenceRegistry.leave_room"""
+        if not self._local.leave_room(sid, room):
+            return False
+        self._redis.hdel(self._room_key(room), sid)
+        return True
+
+    def rooms_of(self, sid):
+        """Return the chat rooms a sid connected to this worker has joined"""
+        return self._local.rooms_of(sid)
+
+    def room_members(self, room):
+        """Return the usernames in a chat room on every worker, once each"""
+        return list(dict.fromkeys(self._redis.hvals(self._room_key(room))))
+
+    def room_count(self):
+        """Number of chat rooms with members on this worker"""
+        return self._local.room_count()
+
+    def __contains__(self, sid):
+        return sid in self._local
+
+    def __len__(self):
+        """Number of authenticated connections across all workers"""
+        return self._redis.hlen(self._connections_key)
+
+
+class PresenceBroadcaster:
+    """Coalesces presence changes and sends them once per tick.
+
+    Joins and leaves are collected as [version, 'add'|'remove', username]
+    changes. Each interval, the latest change of every user goes out in a
+    'presence_update' to that user's presence room only, so it reaches the
+    clients watching them rather than everyone. The dashboard gets at most
+    one 'status_update' per interval.
+
+    That is one emit per changed user, and with a message queue one
+    publish each. A single worker skips users nobody is watching; beyond
+    max_emits per tick the oldest changes go first and the rest wait for
+    the next tick, so a reconnect storm delays some updates instead of
+    flooding the queue.
+    """
+
+    def __init__(self, interval=0.1, max_emits=200):
+        self._lock = threading.Lock()
+        self._changes = []
+        self._clients_changed = False
+        self._socketio = None
+        self._presence = None
+        self._status_room = None
+        self._local_only = True
+        self._max_emits = max_emits
+        self._flusher = PeriodicFlusher(self.flush, interval)
+
+    def init_app(self, app, socketio, presence, status_room=None):
+        self._socketio = socketio
+        self._flusher.init_app(socketio, app.config.get('PRESENCE_BROADCAST_INTERVAL'))
+        self._presence = presence
+        self._status_room = status_room
+        # Without a message queue every watcher is connected to this worker
+        self._local_only = not app.config.get('SOCKETIO_MESSAGE_QUEUE')
+        self._max_emits = app.config.get('PRESENCE_MAX_EMITS_PER_TICK', self._max_emits)
+
+    def joined(self, username, version):
+        self._record([version, 'add', username])
+
+    def left(self, username, version):
+        self._record([version, 'remove', username])
+
+    def clients_changed(self):
+        self._record(None)
+
+    def _record(self, change):
+        with self._lock:
+            if change is not None:
+                self._changes.append(change)
+            self._clients_changed = True
+        self._flusher.start()
+
+    def flush(self):
+        """Send everything collected since the last tick"""
+        with self._lock:
+            changes, self._changes = self._changes, []
+            clients_changed, self._clients_changed = self._clients_changed, False
+        # Only the latest state of each user matters to its watchers
+        latest = {}
+        for change in sorted(changes):
+            latest[change[2]] = change
+        if self._local_only:
+            rooms = self._socketio.server.manager.rooms.get('/', {})
+            latest = {username: change for username, change in latest.items()
+                      if rooms.get(presence_room(username))}
+        due = sorted(latest.values())
+        if len(due) > self._max_emits:
+            due, later = due[:self._max_emits], due[self._max_emits:]
+            with self._lock:
+                self._changes[:0] = later
+        for change in due:
+            self._socketio.emit('presence_update', {'changes': [change]},
+                                room=presence_room(change[2]))
+        if clients_changed:
+            self._socketio.emit('status_update', {'clients': len(self._presence)},
+                                room=self._status_room)
+
+
+def create_presence_registry(url=None):
+    """Return a Redis-backed registry when url is set, a local one otherwise"""
+    if url:
+        return RedisPresenceRegistry(url)
+    return PresenceRegistry()
@@ -0,0 +1,274 @@
+import _thread
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from functools import wraps
+
+from pymongo import monitoring
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+def _native_threads():
+    """Return (start_new_thread, get_ident, sleep) as they were before monkey patching.
+
+    Under eventlet or gevent the patched versions run on the event loop,
+    where the sampler would only ever see itself.
+    """
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('thread'):
+            thread = patcher.original('_thread')
+            return thread.start_new_thread, thread.get_ident, patcher.original('time').sleep
+    if 'gevent' in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            start, ident = monkey.get_original('_thread', ['start_new_thread', 'get_ident'])
+            return start, ident, monkey.get_original('time', 'sleep')
+    return _thread.start_new_thread, _thread.get_ident, time.sleep
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f'{module}:{getattr(code, "co_qualname", code.co_name)}'
+
+
+class SamplingProfiler:
+    """Time-boxed sampling profiler for the whole process.
+
+    A native thread wakes up every interval, reads the current stack of
+    every other thread with sys._current_frames() and counts each one in
+    collapsed form (root;...;leaf), ready for flamegraph.pl or speedscope.
+    Under eventlet and gevent the main thread's stack is whichever green
+    thread is running, or the hub waiting for I/O when nothing is.
+    """
+
+    def __init__(self, max_seconds=30):
+        self._lock = threading.Lock()
+        self.max_seconds = max_seconds
+
+    def init_app(self, app):
+        self.max_seconds = app.config.get('PROFILE_MAX_SECONDS', self.max_seconds)
+
+    def profile(self, seconds, interval=0.005, wait=time.sleep):
+        """Sample for seconds and return (samples, Counter of collapsed stacks).
+
+        wait is used to sleep while the sampler runs, e.g. socketio.sleep so
+        the event loop keeps serving the load being profiled.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            seconds = min(seconds, self.max_seconds)
+            start_thread, get_ident, sleep = _native_threads()
+            result = {}
+            start_thread(self._sample, (seconds, interval, get_ident, sleep, result))
+            while 'stacks' not in result:
+                wait(0.05)
+            return result['samples'], result['stacks']
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _sample(seconds, interval, get_ident, sleep, result):
+        me = get_ident()
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        try:
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    names = []
+                    while frame is not None:
+                        names.append(_frame_name(frame))
+                        frame = frame.f_back
+                    stacks[';'.join(reversed(names))] += 1
+                samples += 1
+                sleep(interval)
+        finally:
+            result['samples'] = samples
+            result['stacks'] = stacks
+
+
+class _MongoTimer(monitoring.CommandListener):
+    def __init__(self, log):
+        self._log = log
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._log.add_mongo_time(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        self._log.add_mongo_time(event.duration_micros / 1e6)
+
+
+class SlowEventLog:
+    """Socket events that took longer than a threshold, and where the time went.
+
+    track() times a handler and, through a thread local (green thread local
+    under eventlet and gevent), adds up the time its MongoDB commands and
+    Socket.IO emits took. Events over the threshold are kept in a ring
+    buffer with the payload's signal type, never its contents.
+    """
+
+    def __init__(self, threshold=0.1, capacity=200):
+        self._lock = threading.Lock()
+        self._entries = deque(maxlen=capacity)
+        self._local = threading.local()
+        self.threshold = threshold
+        self.mongo_listener = _MongoTimer(self)
+
+    def init_app(self, app, socketio):
+        self.threshold = app.config.get('SLOW_EVENT_THRESHOLD', self.threshold)
+        self._entries = deque(self._entries, maxlen=app.config.get('SLOW_EVENT_LOG_SIZE', self._entries.maxlen))
+        if getattr(socketio.emit, 'slow_event_log', None) is self:
+            return
+        # flask_socketio.emit() goes through the instance too, so this sees every emit
+        emit = socketio.emit
+
+        @wraps(emit)
+        def timed_emit(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return emit(*args, **kwargs)
+            finally:
+                self._add(1, time.perf_counter() - started)
+        timed_emit.slow_event_log = self
+        socketio.emit = timed_emit
+
+    def add_mongo_time(self, seconds):
+        self._add(0, seconds)
+
+    def _add(self, index, seconds):
+        timings = getattr(self._local, 'timings', None)
+        if timings is not None:
+            timings[index] += seconds
+
+    def track(self, event):
+        """Decorator recording a Socket.IO event handler when it is slow"""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                outer, timings = getattr(self._local, 'timings', None), [0.0, 0.0]
+                self._local.timings = timings
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    self._local.timings = outer
+                    if elapsed >= self.threshold:
+                        self._record(event, elapsed, timings, args[0] if args else None)
+            return wrapper
+        return decorator
+
+    def _record(self, event, elapsed, timings, data):
+        mongo, emit = timings
+        entry = {
+            'event': event,
+            'at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'payload_type': _payload_type(data),
+            'duration_ms': round(elapsed * 1000, 3),
+            'mongo_ms': round(mongo * 1000, 3),
+            'emit_ms': round(emit * 1000, 3),
+            'other_ms': round(max(elapsed - mongo - emit, 0) * 1000, 3)
+        }
+        with self._lock:
+            self._entries.append(entry)
+
+    def recent(self, event=None):
+        """Return the logged slow events, oldest first, optionally for one event"""
+        with self._lock:
+            entries = list(self._entries)
+        return [entry for entry in entries if event is None or entry['event'] == event]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _payload_type(data):
+    if not isinstance(data, dict):
+        return type(data).__name__ if data is not None else None
+    if isinstance(data.get('signals'), list):
+        types = (s.get('type') for s in data['signals'] if isinstance(s, dict))
+        return ','.join(dict.fromkeys(str(t) for t in types))
+    kind = data.get('type')
+    return str(kind) if kind is not None else 'dict'
+
+
+class MemoryTracer:
+    """tracemalloc snapshots compared against a baseline.
+
+    start() begins tracing and takes the baseline, diff() reports what has
+    been allocated since, grouped by line or traceback. Tracing slows every
+    allocation down, so it only runs between start() and stop().
+    """
+
+    IGNORED = (tracemalloc.__file__, '<frozen importlib._bootstrap>',
+               '<frozen importlib._bootstrap_external>', '<unknown>')
+
+    def __init__(self, frames=10):
+        self._lock = threading.Lock()
+        self._baseline = None
+        self.frames = frames
+
+    def init_app(self, app):
+        self.frames = app.config.get('TRACEMALLOC_FRAMES', self.frames)
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+            self._baseline = self._snapshot()
+
+    def stop(self):
+        with self._lock:
+            self._baseline = None
+            tracemalloc.stop()
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, pattern) for pattern in self.IGNORED])
+
+    def diff(self, group_by='lineno', limit=25, reset=False):
+        """Return the largest allocation changes since the baseline, or None if not tracing"""
+        with self._lock:
+            if self._baseline is None:
+                return None
+            snapshot = self._snapshot()
+            stats = snapshot.compare_to(self._baseline, group_by)
+            if reset:
+                self._baseline = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            'traced_bytes': current,
+            'peak_bytes': peak,
+            'size_diff_bytes': sum(stat.size_diff for stat in stats),
+            'top': [{
+                'size_diff_bytes': stat.size_diff,
+                'size_bytes': stat.size,
+                'count_diff': stat.count_diff,
+                'count': stat.count,
+                'traceback': [f'{frame.filename}:{frame.lineno}' for frame in stat.traceback]
+            } for stat in stats[:limit]]
+        }
+
+
+profiler = SamplingProfiler()
+slow_events = SlowEventLog()
+memory_tracer = MemoryTracer()
@@ -0,0 +1,88 @@
+import functools
+import time
+
+from flask import request
+from flask_socketio import emit
+
+
+class RateLimiter:
+    """Token buckets per connection and socket event.
+
+    Each limited event refills at rate tokens per second up to burst, and
+    an event arriving to an empty bucket is dropped. A bucket is a
+    [tokens, updated_at, throttled] list created the first time a
+    connection sends that event, then updated in place, so an allowed
+    event costs a dict lookup and some arithmetic. The client gets one
+    'rate_limited' event each time it starts being throttled rather than
+    one per dropped event.
+
+    Buckets are not locked: a connection's events are handled one at a
+    time, and a rare race only miscounts a token.
+    """
+
+    def __init__(self, limits=None):
+        self._limits = dict(limits or {})  # Map of event to (rate, burst)
+        self._buckets = {}                 # Map of sid to {event: bucket}
+        self.dropped = {}                  # Map of event to dropped count
+        self.throttled = {}                # Map of event to times a connection got throttled
+
+    def init_app(self, app):
+        self._limits = dict(app.config.get('RATE_LIMITS', self._limits))
+
+    def limit(self, event):
+        """Decorate a socket handler so it only runs while event has tokens left"""
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapped(*args, **kwargs):
+                retry_after = self._take(request.sid, event)
+                if retry_after is None:
+                    return f(*args, **kwargs)
+                if retry_after:
+                    emit('rate_limited', {
+                        'event': event,
+                        'message': f'Too many {event} events, slow down',
+                        'retry_after': round(retry_after, 3)
+                    })
+            return wrapped
+        return decorator
+
+    def _take(self, sid, event):
+        """Take a token; None if allowed, else seconds to wait if newly throttled, 0 if already"""
+        limit = self._limits.get(event)
+        if limit is None:
+            return None
+        rate, burst = limit
+        now = time.monotonic()
+        buckets = self._buckets.get(sid)
+        if buckets is None:
+            buckets = self._buckets[sid] = {}
+        bucket = buckets.get(event)
+        if bucket is None:
+            bucket = buckets[event] = [burst, now, False]
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            bucket[2] = False
+            return None
+        bucket[0] = tokens
+        self.dropped[event] = self.dropped.get(event, 0) + 1
+        if bucket[2]:
+            return 0
+        bucket[2] = True
+        self.throttled[event] = self.throttled.get(event, 0) + 1
+        return (1 - tokens) / rate
+
+    def forget(self, sid):
+        """Drop a disconnected connection's buckets"""
+        self._buckets.pop(sid, None)
+
+    def stats(self):
+        """Return drop and throttle counters per event"""
+        return {
+            'limits': {event: {'rate': rate, 'burst': burst}
+                       for event, (rate, burst) in self._limits.items()},
+            'dropped': dict(self.dropped),
+            'throttled': dict(self.throttled),
+            'connections': len(self._buckets)
+        }
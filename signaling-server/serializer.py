@@ -0,0 +1,88 @@
+from urllib.parse import parse_qs
+
+import msgpack
+from socketio import packet
+
+# Set in the WSGI environ of each connection once its query string has been read
+ENVIRON_KEY = 'p2pchat.msgpack'
+
+# The msgpack parser of the JavaScript client only knows the plain packet types,
+# and MessagePack carries bytes natively so no attachments are needed
+_PLAIN_TYPES = {packet.BINARY_EVENT: packet.EVENT, packet.BINARY_ACK: packet.ACK}
+
+
+class NegotiatedPacket(packet.Packet):
+    """Socket.IO packet read from either JSON text or MessagePack binary frames.
+
+    A client that connects with ?serializer=msgpack sends every packet as
+    one MessagePack binary frame, in the format of socket.io-msgpack-parser.
+    JSON clients only send binary frames as attachments of a packet they
+    announced first, and the server hands those to that packet without
+    decoding them here.
+    """
+
+    def decode(self, encoded_packet):
+        if not isinstance(encoded_packet, bytes):
+            return super().decode(encoded_packet)
+        decoded = msgpack.unpackb(encoded_packet)
+        if not isinstance(decoded, dict) or 'type' not in decoded:
+            raise ValueError('Invalid MessagePack packet')
+        self.packet_type = decoded['type']
+        self.data = decoded.get('data')
+        self.namespace = decoded.get('nsp')
+        self.id = decoded.get('id')
+        return 0
+
+
+def encode_msgpack(pkt):
+    """Encode a packet the way socket.io-msgpack-parser expects it"""
+    encoded = {
+        'type': _PLAIN_TYPES.get(pkt.packet_type, pkt.packet_type),
+        'data': pkt.data,
+        'nsp': pkt.namespace or '/',
+    }
+    if pkt.id is not None:
+        encoded['id'] = pkt.id
+    return msgpack.packb(encoded)
+
+
+def wants_msgpack(environ):
+    """True if the connection asked for MessagePack packets"""
+    if environ is None:
+        return False
+    flag = environ.get(ENVIRON_KEY)
+    if flag is None:
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        flag = environ[ENVIRON_KEY] = query.get('serializer', [''])[0] == 'msgpack'
+    return flag
+
+
+class PacketSerializers:
+    """Lets each client choose between JSON and MessagePack packets.
+
+    JSON stays the default, so existing clients are unaffected. A client
+    connecting with ?serializer=msgpack gets every packet addressed to it
+    encoded as MessagePack, which sends SDP and candidate strings as-is
+    instead of JSON-escaping them, and its own binary packets are decoded
+    by NegotiatedPacket. The choice is per connection and is read from
+    the handshake's query string.
+    """
+
+    def init_app(self, app, socketio):
+        if not app.config.get('SOCKETIO_MSGPACK', True):
+            return
+        server = socketio.server
+        server.packet_class = NegotiatedPacket
+        send_packet = server._send_packet
+
+        # Every packet to a client goes through here, including broadcasts
+        # relayed from other workers through the message queue
+        def negotiated_send_packet(eio_sid, pkt):
+            if wants_msgpack(server.environ.get(eio_sid)):
+                server.eio.send(eio_sid, encode_msgpack(pkt))
+            else:
+                send_packet(eio_sid, pkt)
+        server._send_packet = negotiated_send_packet
+
+
+packet_serializers = PacketSerializers()
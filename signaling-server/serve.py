@@ -0,0 +1,39 @@
+"""Production entry point for the signaling server.
+
+Runs the server without the debugger or reloader on a cooperative event
+loop selected by SOCKETIO_ASYNC_MODE:
+
+- eventlet (default): eventlet's WSGI server with native websockets
+- gevent: gevent's WSGI server, with gevent-websocket if it is installed
+- threading: the Werkzeug server with one thread per connection
+
+The standard library is monkey patched before anything else is imported,
+so the blocking pymongo calls in the socket handlers yield to the loop
+instead of stalling every other connection.
+
+    SECRET_KEY=<random> SOCKETIO_ASYNC_MODE=eventlet python serve.py
+"""
+import os
+
+async_mode = os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'eventlet')
+# Production: also makes the server refuse the default SECRET_KEY
+os.environ.setdefault('FLASK_DEBUG', '0')
+
+if async_mode == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif async_mode == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+from app import create_app, socketio, log_message  # noqa: E402
+from models import password_hasher  # noqa: E402
+
+
+if __name__ == '__main__':
+    app = create_app()
+    log_message(f"Signaling server ({async_mode}) running on http://localhost:{app.config['PORT']}")
+    try:
+        socketio.run(app, host='0.0.0.0', port=app.config['PORT'], debug=False)
+    finally:
+        password_hasher.shutdown()
@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+from flusher import PeriodicFlusher
+
+DASHBOARD_ROOM = 'dashboard'
+
+
+class ServerLog:
+    """Fixed-capacity ring buffer of server log entries.
+
+    New entries are also queued for the dashboard and pushed to the
+    dashboard room in one batched 'log_batch' emit per flush interval, so
+    a burst of events costs a single emit instead of one broadcast each.
+    """
+
+    def __init__(self, capacity=1000, flush_interval=0.25):
+        self._lock = threading.Lock()
+        self._entries = deque(maxlen=capacity)
+        self._pending = deque(maxlen=capacity)
+        self._socketio = None
+        self._flusher = PeriodicFlusher(self.flush, flush_interval)
+
+    def init_app(self, app, socketio):
+        capacity = app.config.get('LOG_CAPACITY', self._entries.maxlen)
+        self._entries = deque(self._entries, maxlen=capacity)
+        self._pending = deque(self._pending, maxlen=capacity)
+        self._socketio = socketio
+        self._flusher.init_app(socketio, app.config.get('LOG_FLUSH_INTERVAL'))
+
+    def append(self, message, msg_type="info"):
+        """Record a log entry and queue it for the dashboard"""
+        log_entry = {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "message": message,
+            "type": msg_type
+        }
+        with self._lock:
+            self._entries.append(log_entry)
+            self._pending.append(log_entry)
+        return log_entry
+
+    def recent(self, count):
+        """Return the last count entries, oldest first"""
+        with self._lock:
+            start = max(len(self._entries) - count, 0)
+            return list(islice(self._entries, start, None))
+
+    def start_flusher(self):
+        """Start the background task that pushes batches to the dashboard"""
+        self._flusher.start()
+
+    def flush(self):
+        """Send the entries queued since the last flush to the dashboard"""
+        with self._lock:
+            if not self._pending:
+                return
+            batch = list(self._pending)
+            self._pending.clear()
+        self._socketio.emit('log_batch', batch, room=DASHBOARD_ROOM)
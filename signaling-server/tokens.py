@@ -0,0 +1,61 @@
+import time
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+# The fallback in config.py and the example in .env: anyone could sign tokens with these
+DEFAULT_SECRET_KEYS = ('', 'hard-to-guess-string', 'your-secret-key-here')
+
+
+class SocketTokens:
+    """HMAC-signed, time-limited tokens for authenticating sockets.
+
+    A token carries the user id and username, signed with SECRET_KEY, so
+    the signaling server can authenticate a socket without a database
+    lookup. Tokens older than half their max_age are worth refreshing;
+    verify() reports that so a fresh one can be handed back. A refreshed
+    token keeps the time of the login that first issued it, and none is
+    accepted max_lifetime after that login, so refreshing cannot keep a
+    token alive forever.
+
+    Outside DEBUG, init_app() refuses the default and example SECRET_KEYs.
+    """
+
+    SALT = 'socket-auth'
+
+    def __init__(self, max_age=12 * 60 * 60, max_lifetime=24 * 60 * 60):
+        self._serializer = None
+        self._max_age = max_age
+        self._max_lifetime = max_lifetime
+
+    def init_app(self, app):
+        secret_key = app.config.get('SECRET_KEY') or ''
+        if secret_key in DEFAULT_SECRET_KEYS and not app.config.get('DEBUG'):
+            raise RuntimeError('SECRET_KEY is unset or a default/example value, so anyone could sign '
+                               'socket tokens; set a random SECRET_KEY')
+        self._serializer = URLSafeTimedSerializer(secret_key, salt=self.SALT)
+        self._max_age = app.config.get('SOCKET_TOKEN_MAX_AGE', self._max_age)
+        self._max_lifetime = app.config.get('SOCKET_TOKEN_MAX_LIFETIME', self._max_lifetime)
+
+    def issue(self, user_id, username, issued_at=None):
+        """Return a signed token for a user.
+
+        issued_at is the time of the login being refreshed, now by default.
+        """
+        return self._serializer.dumps([str(user_id), username, int(issued_at or time.time())])
+
+    def verify(self, token):
+        """Return (user_id, username, issued_at, needs_refresh) for a valid token, None otherwise"""
+        if not isinstance(token, str):
+            return None
+        try:
+            (user_id, username, issued_at), signed_at = self._serializer.loads(
+                token, max_age=self._max_age, return_timestamp=True)
+        except (BadSignature, TypeError, ValueError):
+            return None
+        now = time.time()
+        if not isinstance(issued_at, int) or now - issued_at > self._max_lifetime:
+            return None
+        return user_id, username, issued_at, now - signed_at.timestamp() > self._max_age / 2
+
+
+socket_tokens = SocketTokens()
@@ -0,0 +1,62 @@
+import socket
+from urllib.parse import parse_qs
+
+TRANSPORTS = ('polling', 'websocket')
+
+
+def _client_socket(environ):
+    """The TCP socket behind a websocket request, where the server exposes it"""
+    if 'eventlet.input' in environ:
+        return environ['eventlet.input'].get_socket()
+    if 'gunicorn.socket' in environ:
+        return environ['gunicorn.socket']
+    handler = getattr(environ.get('wsgi.websocket'), 'handler', None)  # gevent-websocket
+    return getattr(handler, 'socket', None)
+
+
+class TransportPolicy:
+    """Which Engine.IO transports clients may use, and how websockets are set up.
+
+    python-engineio 4.2 accepts both transports from every client, so
+    requests for a transport that is not allowed are turned away here
+    before reaching it. With websocket alone, a client connects in one
+    round trip instead of a polling handshake followed by an upgrade.
+
+    Websocket sockets get TCP_NODELAY: a packet with binary attachments is
+    several frames, and Nagle's algorithm would hold the later ones back
+    until the first is acknowledged. permessage-deflate is negotiated by
+    eventlet's websocket server when the client offers it; turning
+    compression off hides the offer.
+    """
+
+    def init_app(self, app, socketio):
+        transports = [transport.strip() for transport in app.config.get('SOCKETIO_TRANSPORTS', TRANSPORTS)]
+        unknown = set(transports) - set(TRANSPORTS)
+        if unknown or not transports:
+            raise ValueError(f'Invalid SOCKETIO_TRANSPORTS: {",".join(transports)}')
+        compression = app.config.get('SOCKETIO_WEBSOCKET_COMPRESSION', True)
+
+        eio = socketio.server.eio
+        if transports == ['websocket'] and eio._async['websocket'] is None:
+            raise RuntimeError(f'SOCKETIO_TRANSPORTS is websocket only, but the {eio.async_mode} '
+                               'async mode has no websocket server installed')
+        # Only offer the upgrade when websockets are allowed
+        eio.allow_upgrades = eio.allow_upgrades and 'websocket' in transports
+        handle_request = eio.handle_request
+
+        def policed_handle_request(environ, start_response):
+            transport = parse_qs(environ.get('QUERY_STRING', '')).get('transport', ['polling'])[0]
+            if transport not in transports:
+                start_response('400 BAD REQUEST', [('Content-Type', 'text/plain')])
+                return [f'Transport {transport} is not allowed'.encode('utf-8')]
+            if transport == 'websocket':
+                client_socket = _client_socket(environ)
+                if client_socket is not None:
+                    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                if not compression:
+                    environ.pop('HTTP_SEC_WEBSOCKET_EXTENSIONS', None)
+            return handle_request(environ, start_response)
+        eio.handle_request = policed_handle_request
+
+
+transport_policy = TransportPolicy()